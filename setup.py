@@ -88,6 +88,9 @@ setup(name='tpv.nix',
               'org/team/repo/list = tpv.github.cli.org:TeamRepoList',
               'org/team/repo/add = tpv.github.cli.org:TeamRepoAdd',
               'org/team/repo/remove = tpv.github.cli.org:TeamRepoRemove',
+              'ratelimit = tpv.github.cli.ratelimit:RateLimit',
+              'cache = tpv.github.cli.cache:Cache',
+              'cache/gc = tpv.github.cli.cache:GC',
           ],
       },
       )
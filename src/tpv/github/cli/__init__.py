@@ -11,6 +11,8 @@ from .switches import ConfigSwitchAttr
 
 # load_entry_points below overwrites the name config by the config module.
 from ..github_base import config as config_object
+from ..github_base import stats, revalidation_wait, wait_for_revalidations, \
+    unit_of_work
 
 
 class ColorFormatter(string.Formatter):
@@ -92,10 +94,19 @@ class Command(tpv.cli.Command):
 
     def format(self, tmpl, **repls):
         """Return `tmpl` formatted by ColorFormatter """
+        return self.format_map(tmpl, repls)
+
+    def format_map(self, tmpl, mapping):
+        """Return `tmpl` formatted by ColorFormatter with the fields of
+`mapping`
+
+Only the fields the template refers to are looked up, so the other
+fields of a lazily loaded resource aren't decoded.
+        """
         if self.colors is None:
             self.colors = ColorFormatter(not self.no_colors)
 
-        return self.colors.format(tmpl, **repls).encode("utf-8")
+        return self.colors.vformat(tmpl, (), mapping).encode("utf-8")
 
 
 class Github(Command):
@@ -136,4 +147,25 @@ tpv.pkg_resources.load_entry_points("tpv.github.gh.commands", Github)
 #     except Exception as exc:
 #         print "Error:", exc.message
 
-app = Github.run
+
+def print_stats():
+    """Print the usage counters of the github access layers to stderr """
+    for layer, counters in sorted(stats().iteritems()):
+        sys.stderr.write("{}: {}\n".format(
+            layer,
+            ", ".join("{}={}".format(k, v)
+                      for k, v in sorted(counters.iteritems()))))
+
+
+def app():
+    try:
+        # the cache writes of the command are written at its end in
+        # one transaction
+        with unit_of_work():
+            Github.run()
+    finally:
+        # let the refreshes of stale data write back
+        wait_for_revalidations(revalidation_wait())
+        if "github.debug" in config_object \
+           and int(config_object["github.debug"]) >= 1:
+            print_stats()
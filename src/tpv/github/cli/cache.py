@@ -0,0 +1,31 @@
+import tpv.cli
+
+from . import Command
+from ..github_base import cache_usage, collect_garbage
+
+
+def print_usage():
+    usage = cache_usage()
+    print u"{:.1f} MiB, {:.1f} MiB free".format(usage["size"] / 2.0**20,
+                                                usage["free"] / 2.0**20)
+    for table, rows in sorted(usage["rows"].iteritems()):
+        print u"  {}: {} rows".format(table, rows)
+
+
+class Cache(Command):
+    """Show the size of the cache db """
+
+    def __call__(self):
+        print_usage()
+
+
+class GC(Command):
+    """Delete expired data from the cache db """
+
+    vacuum = tpv.cli.Flag("--vacuum", default=False,
+                          help="Rewrite the cache db to shrink it completely")
+
+    def __call__(self):
+        deleted = collect_garbage(self.vacuum)
+        print u"Deleted {} rows".format(sum(deleted.itervalues()))
+        print_usage()
@@ -1,4 +1,6 @@
 
+import sys
+
 import tpv.cli
 #from aspects import stdout_to_pager
 
@@ -35,6 +37,10 @@ completion of the options.
     verbose = tpv.cli.Flag(["--verbose", "-v"],
                            help="Print more details on the issues")
 
+    local = tpv.cli.Flag("--local",
+                         help="List the issues seen before from the local "
+                              "cache without asking github")
+
     repo = ConfigSwitchAttr("--repo", str, argname="",
                             help="The repository <user>/<repo>",
                             completion=RepositoryDynamicCompletion())
@@ -66,7 +72,7 @@ completion of the options.
         if issue["assignee"] is not None:
             tmpl += " @{assignee[login]}"
 
-        print self.format(tmpl, **issue)
+        print self.format_map(tmpl, issue)
 
     def print_issue_long(self, issue):
         tmpl = u"#{number} {=cyan}{title}{=normal}\n"
@@ -81,9 +87,15 @@ Author: {user[login]}
         if issue["assignee"] is not None:
             tmpl += "Assignee: {assignee[login]}\n"
 
-        print self.format(tmpl, **issue)
+        print self.format_map(tmpl, issue)
 
     def __call__(self):
+        if self.local and self.mine is not None and self.repo is None:
+            # the issues of the user aren't kept in the local index
+            print >> sys.stderr, \
+                "--local can only be combined with --mine and --repo"
+            return 1
+
         # the backend by default returns all issues. if the cli user
         # doesn't specify the state, show the open ones. if he sets
         # state to all, don't pass it along to the backend. if he sets
@@ -93,6 +105,9 @@ Author: {user[login]}
         elif self.arguments["state"] == "all":
             del self.arguments["state"]
 
+        if self.local:
+            self.arguments["local"] = True
+
         # the mine attribute can be set to "all" (default for the call
         # to "gh issue"), "assigned", "created", "mentioned",
         # "subscribed"
@@ -153,7 +168,7 @@ updated: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **comment)
+        print self.format_map(tmpl, comment)
 
     def print_issue(self, issue):
         tmpl = u'''
@@ -167,7 +182,7 @@ Updated: {updated_at}
         if len(issue["body"]) > 0:
             tmpl += u"\n{body}\n"
 
-        print self.format(tmpl, **issue)
+        print self.format_map(tmpl, issue)
 
         if self.with_comments:
             print self.format("{=cyan}Comments:{=normal}")
@@ -179,6 +194,11 @@ Updated: {updated_at}
     def __call__(self, *issuenumbers):
         self.repo = repo_type(self.repo)
 
+        if self.with_comments and len(issuenumbers) > 1:
+            # list the comments of the whole repository in a few
+            # pages, instead of a request per issue
+            self.repo["comments"].backfill(issuenumbers)
+
         for issueno in issuenumbers:
             issue = issue_type(self.repo, issueno)
             self.print_issue(issue)
@@ -263,7 +283,7 @@ updated: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **comment)
+        print self.format_map(tmpl, comment)
 
     @tpv.cli.completion(issueno=RepoChildIdDynamicCompletion("issues"))
     def __call__(self, issueno):
@@ -78,7 +78,7 @@ class MemList(Command):
 id: {id}
 site_admin: {site_admin}
         """.strip()+"\n"
-        print self.format(tmpl, **member)
+        print self.format_map(tmpl, member)
 
     @tpv.cli.completion(org_name=OwnOrgsDynamicCompletion())
     def __call__(self, org_name):
@@ -238,7 +238,7 @@ class TeamRepoList(Command):
 {=cyan}{name}{=normal}
 {description}
         """.strip() + "\n"
-        print self.format(tmpl, **repo)
+        print self.format_map(tmpl, repo)
 
     @tpv.cli.completion(org=OwnOrgsDynamicCompletion(),
                         team=TeamDynamicCompletion())
@@ -39,7 +39,7 @@ Updated at: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **pull)
+        print self.format_map(tmpl, pull)
 
     def __call__(self):
         repo = repo_type(self.repo)
@@ -67,7 +67,7 @@ class Show(Command):
 Path: {path}
 {diff_hunk}
         '''.strip() + "\n"
-        print self.format(tmpl, **hunk[0])
+        print self.format_map(tmpl, hunk[0])
 
         for comment in hunk:
             commenttmpl = u'''
@@ -76,7 +76,7 @@ updated: {updated_at}
 {body}
             '''.strip()+"\n"
 
-            print self.format(tmpl, **comment)
+            print self.format_map(tmpl, comment)
 
     def print_comment(self, comment):
         tmpl = u'''
@@ -85,7 +85,7 @@ updated: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **comment)
+        print self.format_map(tmpl, comment)
 
     def print_pull(self, pull):
         tmpl = u'''
@@ -97,7 +97,7 @@ Updated at: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **pull)
+        print self.format_map(tmpl, pull)
 
         if self.with_comments:
             # there are two types of comments on a pull request
@@ -127,6 +127,12 @@ Updated at: {updated_at}
     def __call__(self, *pullnumbers):
         self.repo = repo_type(self.repo)
 
+        if self.with_comments and len(pullnumbers) > 1:
+            # list the comments of the whole repository in a few
+            # pages, instead of requests per pull request
+            self.repo["comments"].backfill(pullnumbers)
+            self.repo["pullcomments"].backfill(pullnumbers)
+
         for pullno in pullnumbers:
             pull = pull_type(self.repo, pullno)
             self.print_pull(pull)
@@ -198,7 +204,7 @@ updated: {updated_at}
 {body}
         '''.strip()+"\n"
 
-        print self.format(tmpl, **comment)
+        print self.format_map(tmpl, comment)
 
     @tpv.cli.completion(pullno=RepoChildIdDynamicCompletion("pulls"))
     def __call__(self, pullno):
@@ -0,0 +1,30 @@
+import time
+
+from . import Command
+from ..github_base import github_request, rate_limit, token_pool
+
+
+class RateLimit(Command):
+    """Show the remaining rate limit budget of the configured tokens """
+
+    def __call__(self):
+        pool = token_pool()
+        if rate_limit(pool.primary) is None:
+            # requesting /rate_limit doesn't count against the budget,
+            # but reports it like every other response
+            github_request("GET", "/rate_limit")
+
+        tmpl = u"{=cyan}{remaining}{=normal}/{limit} requests left, " \
+               u"reset at {reset}"
+        for identity, token in pool.tokens:
+            budget = rate_limit(identity)
+            prefix = u"{}: ".format(identity) if len(pool.tokens) > 1 else u""
+            if budget is None:
+                print prefix + u"unknown until its first request"
+                continue
+            print prefix + self.format(
+                tmpl,
+                remaining=budget["remaining"],
+                limit=budget["limit"],
+                reset=time.strftime("%H:%M:%S",
+                                    time.localtime(budget["reset"])))
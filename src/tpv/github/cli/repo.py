@@ -25,7 +25,7 @@ Description: {description}
             tmpl += u"homepage: {homepage}\n"
         tmpl += u"updated: {updated_at}\n"
 
-        print self.format(tmpl, **repo)
+        print self.format_map(tmpl, repo)
 
     def __call__(self, user=None):
         '''List Repositories
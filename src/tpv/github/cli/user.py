@@ -28,7 +28,7 @@ class Show(Command):
         if "location" in user and user["location"] is not None:
             tmpl += u"Location: {location}\n"
 
-        print self.format(tmpl, **user)
+        print self.format_map(tmpl, user)
 
     def __call__(self, *users):
         if len(users) < 1:
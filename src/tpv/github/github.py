@@ -1,10 +1,10 @@
 from metachao import classtree
-import itertools
 
 from .github_base import \
     cache, \
     extract_repo_from_issue_url, \
     GhBase, GhResource, GhCollection, \
+    depends_on, \
     github_request, github_request_paginated, \
     set_on_new_dict, authenticated_user
 
@@ -15,31 +15,37 @@ class GhComment(GhResource):
     url_template = "/repos/{user}/{repo}/issues/comments/{commentid}"
 
 
-class GhRepoComments(GhCollection):
-    """The comments of some repository
+class GhIssueComments(GhCollection):
+    """The comments of some issue
     """
 
     child_class = GhComment
     child_parameter = "commentid"
 
-    list_url_template = "/repos/{user}/{repo}/issues/comments"
+    list_url_template = "/repos/{user}/{repo}/issues/{issueno}/comments"
     list_key = "id"
+    incremental_sync = True
+
+    add_url_template = list_url_template
+    add_required_arguments = ["body"]
 
     delete_url_template = "/repos/{user}/{repo}/issues/comments/{commentid}"
 
 
-class GhIssueComments(GhCollection):
-    """The comments of some issue
+class GhRepoComments(GhCollection):
+    """The comments of some repository
     """
 
     child_class = GhComment
     child_parameter = "commentid"
 
-    list_url_template = "/repos/{user}/{repo}/issues/{issueno}/comments"
+    list_url_template = "/repos/{user}/{repo}/issues/comments"
     list_key = "id"
+    incremental_sync = True
 
-    add_url_template = list_url_template
-    add_required_arguments = ["body"]
+    backfill_class = GhIssueComments
+    backfill_parameter = "issueno"
+    backfill_url_field = "issue_url"
 
     delete_url_template = "/repos/{user}/{repo}/issues/comments/{commentid}"
 
@@ -50,6 +56,9 @@ class GhIssue(GhResource, classtree.Base):
     """
 
     url_template = "/repos/{user}/{repo}/issues/{issueno}"
+    index_kind = "issues"
+    # issue and pull request bodies are long texts
+    compress_cache = True
 
 GhIssue["comments"] = GhIssueComments
 
@@ -63,24 +72,17 @@ class GhRepoIssues(GhCollection):
 
     list_url_template = "/repos/{user}/{repo}/issues"
     list_key = "number"
+    incremental_sync = True
 
     add_url_template = "/repos/{user}/{repo}/issues"
 
     # as github provides only either open or closed issues, we chain
-    # two separate calls to get all of them
-    def _get_resources(self, **arguments):
-        urlpath = self.list_url_template.format(**self._parameters)
+    # two separate calls to get (or count) all of them
+    def _list_queries(self, arguments):
         if "state" in arguments:
-            return github_request_paginated("GET", urlpath, params=arguments)
-        else:
-            open_issues = github_request_paginated("GET", urlpath,
-                                                   params=arguments)
-
-            # due to asynchronicity we may not change the same object
-            arguments = set_on_new_dict(arguments, "state", "closed")
-            closed_issues = github_request_paginated("GET", urlpath,
-                                                     params=arguments)
-            return itertools.chain(open_issues, closed_issues)
+            return [arguments]
+        # due to asynchronicity we may not change the same object
+        return [arguments, set_on_new_dict(arguments, "state", "closed")]
 
 
 class GhPullComment(GhResource):
@@ -115,6 +117,10 @@ class GhRepoPullComments(GhCollection):
     list_url_template = "/repos/{user}/{repo}/pulls/comments"
     list_key = "id"
 
+    backfill_class = GhPullComments
+    backfill_parameter = "issueno"
+    backfill_url_field = "pull_request_url"
+
     delete_url_template = "/repos/{user}/{repo}/pulls/comments/{commentid}"
 
 
@@ -124,6 +130,8 @@ class GhPull(GhResource, classtree.Base):
     """
 
     url_template = "/repos/{user}/{repo}/pulls/{issueno}"
+    index_kind = "pulls"
+    compress_cache = True
 
 GhPull["issue"] = GhIssue
 GhPull["comments"] = GhPullComments
@@ -142,20 +150,12 @@ class GhRepoPulls(GhCollection):
     add_url_template = "/repos/{user}/{repo}/pulls"
 
     # as github provides only either open or closed pull requests, we
-    # chain two separate calls to get all of them
-    def _get_resources(self, **arguments):
-        urlpath = self.list_url_template.format(**self._parameters)
+    # chain two separate calls to get (or count) all of them
+    def _list_queries(self, arguments):
         if "state" in arguments:
-            return github_request_paginated("GET", urlpath, params=arguments)
-        else:
-            open_issues = github_request_paginated("GET", urlpath,
-                                                   params=arguments)
-
-            # due to asynchronicity we may not change the same object
-            arguments = set_on_new_dict(arguments, "state", "closed")
-            closed_issues = github_request_paginated("GET", urlpath,
-                                                     params=arguments)
-            return itertools.chain(open_issues, closed_issues)
+            return [arguments]
+        # due to asynchronicity we may not change the same object
+        return [arguments, set_on_new_dict(arguments, "state", "closed")]
 
 
 @classtree.instantiate
@@ -298,6 +298,8 @@ class GhUserIssues(GhRepoIssues):
     """The issues of the authenticated user"""
 
     list_url_template = "/user/issues"
+    # the issues are instantiated from their urls
+    incremental_sync = False
 
     # Creating a new issue can only be done from within a repository
     @property
@@ -320,9 +322,14 @@ repo tuple from the url of the issue.
         """Return a subset of issue resources, which can only be instantiated
 by using the url of the issue
         """
-        for data in self._get_resources(**arguments):
+        if arguments.pop("local", False):
+            raise ValueError("The issues of a user can't be searched locally")
+
+        def item(data):
             issueno = data[self.list_key]
-            yield (issueno, self._instantiate_child_from_url(issueno, data))
+            return (issueno, self._instantiate_child_from_url(issueno, data))
+
+        return self._search_resources(arguments, item)
 
 
 class GhUserOrgs(GhCollection):
@@ -374,3 +381,35 @@ class Github(GhBase, classtree.Base):
 Github["repos"] = GhRepos
 Github["users"] = GhUsers
 Github["orgs"] = GhOrgs
+
+
+# The cached nodes, which change with other nodes, see depends_on.
+
+# comments change the comment count of their issue or pull request
+depends_on(GhIssue, GhIssueComments, ("user", "repo", "issueno"))
+depends_on(GhPull, GhIssueComments, ("user", "repo", "issueno"))
+depends_on(GhPull, GhPullComments, ("user", "repo", "issueno"))
+
+# and are listed by their issue or pull request and the repository
+depends_on(GhRepoComments, GhIssueComments, ("user", "repo"), "patch")
+depends_on(GhIssueComments, GhRepoComments, ("user", "repo"), "patch")
+depends_on(GhRepoPullComments, GhPullComments, ("user", "repo"), "patch")
+depends_on(GhPullComments, GhRepoPullComments, ("user", "repo"), "patch")
+
+# pull requests are issues
+depends_on(GhPull, GhIssue, ("user", "repo", "issueno"))
+depends_on(GhIssue, GhPull, ("user", "repo", "issueno"))
+depends_on(GhRepoIssues, GhRepoPulls, ("user", "repo"))
+
+# issues changed from within the repository may be assigned to the
+# user (or no longer be) and the other way round
+depends_on(GhUserIssues, GhRepoIssues)
+depends_on(GhUserIssues, GhIssue)
+depends_on(GhRepoIssues, GhIssue, ("user", "repo"), "queries")
+
+# teams count their members and repositories, and members leave the
+# organisation with their last team
+depends_on(GhTeam, GhTeamMembers, ("teamid",))
+depends_on(GhTeam, GhTeamRepos, ("teamid",))
+depends_on(GhOrgMembers, GhTeamMembers, ("org",))
+depends_on(GhOrgMembers, GhOrgTeams, ("org",))
@@ -1,19 +1,27 @@
-from requests import request
 import sqlite3
 import json
 import os
 import sys
 import time
-import pickle
 from ConfigParser import ConfigParser
 import re
-from itertools import chain
+import threading
+from collections import Mapping
+from contextlib import contextmanager
+from itertools import chain, izip
+from multiprocessing.pool import ThreadPool
+from urllib import urlencode
+from Queue import Queue, Empty, Full
 
 from metachao import aspect
 from metachao.classtree import CLASSTREE_ATTR
 from tpv.ordereddict import OrderedDict
 import tpv.generic
 
+from . import serialization
+from .transport import \
+    GithubTransport, RateLimiter, SingleFlight, TokenPool, config_option
+
 URL_BASE = 'https://api.github.com'
 
 
@@ -36,6 +44,31 @@ def set_on_new_dict(basedict, key, value):
 #
 # where the personal access token can be generated with "Create new
 # token" on https://github.com/settings/applications.
+#
+# Tokens of further identities in a section
+#
+#   [github tokens]
+#   <user>=<personal access token>
+#
+# take a share of the read-only requests (see TokenPool in
+# tpv.github.transport).
+#
+# The connection pool and timeouts of the HTTP transport are set in
+# the "Transport" section (see tpv.github.transport), which also takes
+# the number of pages fetched at once by github_request_paginated:
+#
+#   [Transport]
+#   page_concurrency=4
+#   prefetch=1
+#
+# Option async_workers sets the number of threads running the
+# asynchronous calls (aget, asearch, aupdate) of the dictionary tree,
+# batch_concurrency the number of mutations sent at the same time by
+# the batch calls (add_many, update_many, del_many) of collections.
+#
+# Requests are paced by the rate limit budget (see the "Rate limit"
+# section in tpv.github.transport) and retried after transient
+# failures (see the "Retry" section there).
 
 
 class RelativeDictionaryAccess(aspect.Aspect):
@@ -203,6 +236,26 @@ sections of the same name are merged.
 config = DictConfigParser(".ghconfig")
 
 
+def class_option(section, cls, default):
+    """Return the option for `cls` from config `section` or `default`
+
+Options are looked up by class name, f.ex.
+
+  [Expiral time]
+  GhRepoIssues=3600
+    """
+    try:
+        options = config[section]
+    except KeyError:
+        return default
+
+    # ConfigParser lowercases option names
+    for name in (cls.__name__, cls.__name__.lower()):
+        if name in options:
+            return options[name]
+    return default
+
+
 def authenticated_user():
     return config["github.user"]
 
@@ -213,7 +266,105 @@ def extract_repo_from_issue_url(url):
     return (m.group(1), m.group(2))
 
 
-def github_request(method, urlpath, data=None, params=None):
+# The transport is shared by all requests of a process. A forked
+# child must not reuse the parent's sockets, so it gets its own.
+_transport = dict()
+# guards the creation of per-process objects
+_process_lock = threading.RLock()
+
+
+def transport():
+    """Return the GithubTransport of the current process """
+    pid = os.getpid()
+    with _process_lock:
+        if pid not in _transport:
+            _transport.clear()
+            _transport[pid] = GithubTransport.from_config(
+                config, on_retry=debug_retry)
+        return _transport[pid]
+
+
+def debug_retry(method, url, delay, reason):
+    """Report a retry of the transport, as it happens """
+    if "github.debug" in config and int(config["github.debug"]) >= 1:
+        sys.stderr.write("Retrying {} {} in {:.1f}s after {}\n"
+                         .format(method, url, delay, reason))
+
+
+_rate_limiter = []
+
+
+def rate_limiter():
+    """Return the RateLimiter scheduling the requests of this process """
+    with _process_lock:
+        if not _rate_limiter:
+            GhBase.init_sqlite()
+            _rate_limiter.append(
+                RateLimiter.from_config(lambda: GhBase.sqlite, config))
+        return _rate_limiter[0]
+
+
+def rate_limit(identity=None):
+    """Return the rate limit budget of `identity` (default: the
+authenticated user) as dictionary with the keys remaining, limit and
+reset (unix time) or None, if no response reported it yet.
+    """
+    if identity is None:
+        identity = config["github.user"]
+    return rate_limiter().budget(identity)
+
+
+# the token pool of the process, built once from the config, so that it
+# keeps counting the requests of each identity
+_token_pool = dict()
+
+
+def token_pool():
+    """Return the TokenPool of the current process
+
+Raises KeyError, if no authenticated user is configured.
+    """
+    pid = os.getpid()
+    with _process_lock:
+        if pid not in _token_pool:
+            pool = TokenPool.from_config(config,
+                                         lambda x: rate_limiter().budget(x))
+            _token_pool.clear()
+            _token_pool[pid] = pool
+        return _token_pool[pid]
+
+
+# identical GET requests in flight at the same time are sent only once
+single_flight = SingleFlight()
+
+
+def stats():
+    """Return usage counters of the github access layers
+
+With several configured tokens the requests and budget of each
+identity are listed as layer "token <identity>", the hits and misses
+of the memory cache as "memory cache <class>".
+    """
+    ret = dict(transport=transport().stats(),
+               singleflight=single_flight.stats())
+    for counter, counters in memory_cache().stats().iteritems():
+        ret["memory cache" + (" " + counter if counter else "")] = counters
+    try:
+        pool = token_pool()
+    except KeyError:
+        # no authenticated user configured
+        return ret
+
+    budget = rate_limit(pool.primary)
+    if budget is not None:
+        ret["ratelimit"] = budget
+    if len(pool.tokens) > 1:
+        for identity, counters in pool.stats().iteritems():
+            ret["token " + identity] = counters
+    return ret
+
+
+def github_request(method, urlpath, data=None, params=None, headers=None):
     """Request `urlpath` from github using authentication from config
 
     Arguments:
@@ -221,18 +372,54 @@ def github_request(method, urlpath, data=None, params=None):
     - `urlpath`: the path part of the request url, i.e. /users/coroa
     - `data`: POST/PATCH supplied arguments (dictionary)
     - `params`: GET parameters to be added to the url (dictionary)
+    - `headers`: extra request headers (dictionary), f.ex. the
+                 conditional_headers of a cached response
 
     Returns a Request object for the call to github.
+
+    Concurrent GET requests with the same urlpath, params and headers
+    share one request to github and its response. Read-only requests
+    may be sent with any of the configured tokens (see token_pool).
     """
-    req = request(method, URL_BASE + urlpath,
-                  auth=(config["github.user"],
-                        config["github.token"]),
-                  data=None
-                  if data is None
-                  else json.dumps(data),
-                  params=params)
+    def send():
+        return send_request(method, urlpath, data, params, headers)
+
+    if method == "GET":
+        key = (method, page_key(urlpath, params),
+               tuple(sorted(headers.iteritems())) if headers else None)
+        return single_flight.do(key, send)
+    else:
+        return send()
+
+
+def send_request(method, urlpath, data, params, headers):
+    """Send a request to github within the rate limit (see github_request)
+    """
+    (identity, token) = token_pool().choose(method, urlpath)
+    waited = rate_limiter().acquire(identity)
+    if waited > 0 and "github.debug" in config \
+       and int(config["github.debug"]) >= 1:
+        sys.stderr.write("Waited {:.1f}s for the rate limit of {}\n"
+                         .format(waited, identity))
+
+    req = transport().request(method, URL_BASE + urlpath,
+                              auth=(identity, token),
+                              data=None
+                              if data is None
+                              else json.dumps(data),
+                              params=params,
+                              headers=headers)
+    rate_limiter().record(identity, req.headers)
 
     if "github.debug" in config and int(config["github.debug"]) >= 2:
+        try:
+            respbody = json.dumps(req.json(),
+                                  indent=2,
+                                  separators=(',', ': '))
+        except ValueError:
+            # f.ex. the empty body of a 304 Not Modified
+            respbody = ""
+
         sys.stderr.write(('''
 >>> Request
 {method} {url}
@@ -245,44 +432,689 @@ def github_request(method, urlpath, data=None, params=None):
             url=req.request.url,
             reqbody=req.request.body,
             status=req.headers["status"],
-            respbody=json.dumps(req.json(),
-                                indent=2,
-                                separators=(',', ': '))
+            respbody=respbody
         ))
 
     return req
 
 
-def github_request_paginated(method, urlpath, params=None):
+def conditional_headers(etag, last_modified):
+    """Return the headers to revalidate a cached response
+
+github answers with "304 Not Modified" (which doesn't count against
+the rate limit), if the resource didn't change since.
+    """
+    headers = dict()
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if last_modified is not None:
+        headers["If-Modified-Since"] = last_modified
+    return headers or None
+
+
+def page_key(urlpath, params=None):
+    """Return `urlpath` with `params` in a canonical order as query """
+    if not params:
+        return urlpath
+    return urlpath + ("&" if "?" in urlpath else "?") + \
+        urlencode(sorted(params.iteritems()), True)
+
+
+def canonical_query(arguments):
+    """Return the filter `arguments` as query string, which is the same
+for equivalent filters.
+
+Arguments are sorted by name, lists and the comma separated labels are
+sorted and booleans are spelled like github does.
+    """
+    def text(value):
+        # byte strings are taken as utf-8, like they are sent to github
+        return (value.decode("utf-8") if isinstance(value, str)
+                else unicode(value))
+
+    normalized = []
+    for name, value in arguments.iteritems():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif isinstance(value, (list, tuple, set)):
+            value = u",".join(sorted(text(x) for x in value))
+        elif name == "labels":
+            value = u",".join(sorted(x.strip()
+                                     for x in text(value).split(",")))
+        normalized.append((name, text(value).encode("utf-8")))
+    return urlencode(sorted(normalized))
+
+
+def page_concurrency():
+    """Return the number of pages fetched at the same time (Transport
+section, option page_concurrency); 1 walks the pages one by one.
+    """
+    return config_option(config, "Transport.page_concurrency", 4)
+
+
+def page_prefetch():
+    """Return the number of pages fetched ahead of the consumer while
+walking the pages one by one (Transport section, option prefetch); 0
+fetches a page only once the previous one has been consumed.
+    """
+    return config_option(config, "Transport.prefetch", 1)
+
+
+def github_request_paginated(method, urlpath, params=None,
+                             concurrency=None, prefetch=None):
     """Generator, which yields all items of a multipage github request for
 lists of objects.
+
+Once the first page reveals the rel="last" page, the remaining pages
+are fetched by up to `concurrency` threads at the same time (default
+from page_concurrency()), while the items are still yielded in page
+order.
+
+Otherwise the rel="next" links are followed one after another. A
+thread fetches up to `prefetch` pages (default from page_prefetch())
+ahead, so the next page is on its way while the consumer processes
+the current one. `concurrency` 1 and `prefetch` 0 request each page
+only once its predecessor is consumed.
+
+Fetching the next pages starts as soon as the first page arrives;
+closing the generator early stops all outstanding fetches.
+
+The pages of GET requests are kept in the page cache together with
+their ETag and Last-Modified headers, so that a page which didn't
+change since is revalidated instead of downloaded again.
     """
-    while urlpath:
-        req = github_request(method, urlpath, params=params)
-        if '200 OK' not in req.headers['status']:
-            raise RuntimeError(req.json()['message'])
+    if concurrency is None:
+        concurrency = page_concurrency()
+    if prefetch is None:
+        prefetch = page_prefetch()
+
+    origin = page_key(urlpath, params)
+    cached = cached_pages(origin) if method == "GET" else dict()
+
+    req = request_page(method, urlpath, params, cached, origin)
+    (items, link) = page_items(method, origin, origin, req, cached)
+
+    urlpaths = remaining_pages(link) if concurrency > 1 else []
+    if urlpaths:
+        responses = PageFanOut(method, urlpaths, cached, concurrency)
+    elif prefetch > 0 and next_page(link):
+        responses = AsyncIterator(follow_pages(method, link, cached),
+                                  prefetch)
+    else:
+        responses = follow_pages(method, link, cached)
 
-        for elem in req.json():
+    try:
+        for elem in items:
             yield elem
 
-        urlpath = None
-        if "Link" in req.headers:
-            m = re.search('<(https[^>]*)>; rel="next"', req.headers["Link"])
-            if m:
-                urlpath = m.group(1)[len(URL_BASE):]
+        for urlpath, req in responses:
+            (items, link) = page_items(method, urlpath, origin, req, cached)
+            for elem in items:
+                yield elem
+    finally:
+        responses.close()
+
+
+def request_page(method, urlpath, params, cached, key=None):
+    """Request a page, conditionally if it is among the `cached` pages
+
+A 304 Not Modified only validates the items of the page. If it lacks
+the Link header of a page which had one, the pages after it may have
+changed, so the page is requested again without validators.
+
+Only talks to github, so it can be run by worker threads.
+    """
+    if key is None:
+        key = urlpath
+    if key not in cached:
+        return github_request(method, urlpath, params=params)
+
+    req = github_request(method, urlpath, params=params,
+                         headers=conditional_headers(*cached[key][:2]))
+    if '304 Not Modified' in req.headers['status'] \
+            and "Link" not in req.headers and cached[key][2] is not None:
+        req = github_request(method, urlpath, params=params)
+    return req
+
+
+def page_items(method, key, origin, req, cached):
+    """Return (items, link) of the page `key` from the response `req`
+
+Falls back to the cached page on a 304 Not Modified and caches
+downloaded pages of GET requests.
+    """
+    if key in cached and '304 Not Modified' in req.headers['status']:
+        (etag, last_modified, link, items) = cached_page(key)
+        # the pages after it are linked by the 304 (see request_page)
+        link = req.headers.get("Link")
+        touch_page(key, link)
+    elif '200 OK' not in req.headers['status']:
+        raise RuntimeError(req.json()['message'])
+    else:
+        items = req.json()
+        link = req.headers.get("Link")
+        if method == "GET":
+            store_page(key, origin, req.headers, items)
+
+    return (items, link)
+
+
+def follow_pages(method, link, cached):
+    """Generator of (urlpath, response) for the pages following `link` """
+    urlpath = next_page(link)
+    while urlpath:
+        req = request_page(method, urlpath, None, cached)
+        yield (urlpath, req)
+        urlpath = next_page(req.headers.get("Link"))
+
 
+class PageFanOut(object):
+    """Requests `urlpaths` with a pool of `concurrency` threads
 
-def github_request_length(urlpath):
+Iterating yields (urlpath, response) in the order of `urlpaths`.
+    """
+
+    def __init__(self, method, urlpaths, cached, concurrency):
+        self.urlpaths = urlpaths
+        self.pool = ThreadPool(min(concurrency, len(urlpaths)))
+        self.responses = self.pool.imap(
+            lambda urlpath: request_page(method, urlpath, None, cached),
+            urlpaths)
+
+    def __iter__(self):
+        return izip(self.urlpaths, self.responses)
+
+    def close(self):
+        self.pool.terminate()
+
+
+class AsyncIterator(object):
+    """Iterates `iterable` in a thread of its own, which stays up to
+`depth` items ahead of the consumer.
+
+Iterating yields the items of `iterable` in order and re-raises
+exceptions in the consuming thread. close() stops the thread before
+it requests the next item.
+    """
+
+    def __init__(self, iterable, depth):
+        self.queue = Queue(depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(iterable,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, iterable):
+        try:
+            iterator = iter(iterable)
+            while not self.stopped.is_set():
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.put((item,))
+        except Exception:
+            self.put(sys.exc_info())
+        self.put(None)
+
+    def put(self, item):
+        """Queue `item`, unless the consumer is gone """
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, True, 0.1)
+                return
+            except Full:
+                pass
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get(True, 0.1)
+            except Empty:
+                continue
+
+            if item is None:
+                return
+            elif len(item) == 3:
+                # an exception raised by the iterable
+                raise item[0], item[1], item[2]
+            yield item[0]
+
+    def close(self):
+        self.stopped.set()
+
+
+def next_page(link):
+    """Return the urlpath of the rel="next" page from a Link header """
+    if link is not None:
+        m = re.search('<(https[^>]*)>; rel="next"', link)
+        if m:
+            return m.group(1)[len(URL_BASE):]
+    return None
+
+
+def remaining_pages(link):
+    """Return the urlpaths of the pages from rel="next" up to rel="last"
+
+The urlpaths are derived from the rel="last" link by replacing its
+page parameter. Returns an empty list, if the Link header doesn't
+reveal the last page.
+    """
+    if link is None:
+        return []
+
+    next_link = re.search('<(https[^>]*)>; rel="next"', link)
+    last_link = re.search('<(https[^>]*)>; rel="last"', link)
+    if next_link is None or last_link is None:
+        return []
+
+    first = re.search('[?&]page=(\d+)', next_link.group(1))
+    last = re.search('[?&]page=(\d+)', last_link.group(1))
+    if first is None or last is None:
+        return []
+
+    last_urlpath = last_link.group(1)[len(URL_BASE):]
+    return [re.sub('([?&])page=\d+',
+                   lambda m: "{}page={}".format(m.group(1), page),
+                   last_urlpath)
+            for page in range(int(first.group(1)), int(last.group(1)) + 1)]
+
+
+def github_request_length(urlpath, params=None):
     """Return the number of items of a github request for lists of
 objects.
+
+Requests a single item per page, so the page number of the rel="last"
+link is the number of items. Without the link all items fit on the
+one page.
     """
-    req = github_request("GET", urlpath + "?per_page=1")
+    req = github_request("GET", urlpath,
+                         params=merge_dicts(params or dict(),
+                                            dict(per_page=1)))
+    if '200 OK' not in req.headers['status']:
+        raise RuntimeError(req.json()['message'])
+
     m = re.search('<https[^>]*[?&]page=(\d+)[^>]*>; rel="last"',
-                  req.headers["Link"])
+                  req.headers.get("Link") or "")
     if m:
         return int(m.group(1))
     else:
-        return 0
+        return len(req.json())
+
+
+def cache_db_filepath():
+    try:
+        return config["Cache DB.filepath"]
+    except KeyError:
+        return "/tmp/githubcache.db"
+
+
+class ThreadLocalConnection(object):
+    """Descriptor for the connection to the cache db
+
+A sqlite connection may only be used by the thread which opened it,
+so every thread gets a connection of its own. A process forked after
+a thread opened its connection gets a new one, too.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __get__(self, inst, cls):
+        # threading.local keeps the values of the forking thread in the
+        # child process, whose connection must not be shared
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.connection = connect_cache_db()
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+
+def busy_timeout():
+    """Seconds a connection waits for the locks of other connections to
+the cache db, before it raises "database is locked".
+    """
+    return config_option(config, "Cache DB.busy_timeout", 30, float)
+
+
+def journal_mode():
+    """Journal mode of the cache db, write-ahead logging lets the readers
+go on while another connection writes. Set "delete" for file systems
+without shared memory (f.ex. NFS).
+    """
+    return config_option(config, "Cache DB.journal_mode", "wal", str)
+
+
+# pragmas of each connection to the cache db, overridden by the options
+# of the same name in config section "Cache DB":
+#   synchronous  NORMAL only syncs at checkpoints with write-ahead
+#                logging, a power loss may lose recent rows of the cache
+#   mmap_size    bytes of the cache db file read through memory mapping
+#   cache_size   pages, or KiB if negative, of the page cache
+connection_pragmas = (("synchronous", "NORMAL", str),
+                      ("mmap_size", 64*1024*1024, int),
+                      ("cache_size", -8*1024, int))
+
+
+def connect_cache_db():
+    """Return a new connection to the cache db in autocommit mode """
+    connection = sqlite3.connect(cache_db_filepath(),
+                                 timeout=busy_timeout(),
+                                 isolation_level=None)
+    for (pragma, default, argtype) in connection_pragmas:
+        value = config_option(config, "Cache DB." + pragma, default, argtype)
+        if argtype is str and not value.isalnum():
+            raise ValueError("Invalid value of Cache DB.{}: {}"
+                             .format(pragma, value))
+        connection.execute("pragma {} = {}".format(pragma, value)).fetchall()
+    return connection
+
+
+# SQL expressions of the version of a row of the entity store (by url)
+# and of the cache (by identifier and parameters) written anew. Each
+# write of the data of a row bumps it, so the memory cache notices the
+# changes which keep the expiral time and validators, f.ex. partial
+# data merged into a row or a row written twice in a second.
+ENTITY_VERSION = ("(select coalesce(max(version), 0) + 1 from entities"
+                  " where url=?)")
+CACHE_VERSION = ("(select coalesce(max(version), 0) + 1 from cache"
+                 " where identifier=? and parameters=?)")
+
+
+class UnitOfWork(object):
+    """Cache writes of a thread deferred until flush
+
+The rows of the entity store, the cache rows of nodes and of queries
+and the rows of the local index (see store_entity, GhBase.serialize,
+GhCollection._store_query and index_item) are kept by their key, so
+that later writes of the same row replace the earlier ones, and are
+written in a single transaction by flush. Rows whose data didn't
+change only get their expiral time updated. The reads of the thread
+see the deferred rows, local_search flushes them first.
+    """
+
+    def __init__(self):
+        # url -> (row, blob, touch) and (identifier, parameters) ->
+        # (row, blob, touch), where row is the decoded row and touch
+        # tells whether only its expiral time changed
+        self.entities = OrderedDict()
+        self.rows = OrderedDict()
+        # (repo, kind, number) -> (row of items, labels or None)
+        self.items = OrderedDict()
+
+    @staticmethod
+    def _put(pending, key, row, blob, touch):
+        previous = pending.get(key)
+        if touch and previous is not None and not previous[2]:
+            # the data of the deferred row didn't change either
+            (blob, touch) = (previous[1], False)
+        pending[key] = (row, blob, touch)
+
+    def put_entity(self, url, row, blob, touch):
+        self._put(self.entities, url, row, blob, touch)
+
+    def put_row(self, identifier, parameters, row, blob, touch):
+        self._put(self.rows, (identifier, parameters), row, blob, touch)
+
+    def put_item(self, row, labels):
+        self.items[row[:3]] = (row, labels)
+
+    def drop_rows(self, identifiers, prefix):
+        """Drop the deferred cache rows of `identifiers`, whose parameters
+start with `prefix`
+        """
+        for key in [key for key in self.rows
+                    if key[0] in identifiers and key[1].startswith(prefix)]:
+            del self.rows[key]
+
+    def flush(self):
+        """Write the deferred rows """
+        if not self.entities and not self.rows and not self.items:
+            return
+
+        (entities, rows) = (self.entities.items(), self.rows.items())
+        items = self.items.values()
+        with GhBase.transaction():
+            db = GhBase.sqlite
+            db.executemany("insert or replace into entities"
+                           " (url, data, complete_expires, partial_expires,"
+                           "  etag, last_modified, version)"
+                           " values (?,?,?,?,?,?," + ENTITY_VERSION + ")",
+                           ((url, buffer(blob)) + tuple(row[1:]) + (url,)
+                            for url, (row, blob, touch) in entities
+                            if not touch))
+            db.executemany("update entities set complete_expires=?,"
+                           " partial_expires=? where url=?",
+                           (row[1:3] + (url,)
+                            for url, (row, blob, touch) in entities
+                            if touch))
+            db.executemany("insert or replace into cache"
+                           " (identifier, parameters, expires, data,"
+                           "  etag, last_modified, version)"
+                           " values (?,?,?,?,?,?," + CACHE_VERSION + ")",
+                           (key + (row[2], buffer(blob)) + tuple(row[1])
+                            + key
+                            for key, (row, blob, touch) in rows
+                            if not touch))
+            db.executemany("update cache set expires=?"
+                           " where identifier=? and parameters=?",
+                           ((row[2],) + key
+                            for key, (row, blob, touch) in rows
+                            if touch))
+            db.executemany("insert or replace into items"
+                           " values (?,?,?,?,?,?,?,?,?,?,?)",
+                           (row for row, labels in items))
+            db.executemany("delete from item_labels"
+                           " where repo=? and kind=? and number=?",
+                           (row[:3] for row, labels in items
+                            if labels is not None))
+            db.executemany("insert or ignore into item_labels"
+                           " values (?,?,?,?)",
+                           (row[:3] + (label,) for row, labels in items
+                            if labels is not None
+                            for label in labels))
+        self.clear()
+
+    def clear(self):
+        """Drop the deferred rows """
+        self.entities.clear()
+        self.rows.clear()
+        self.items.clear()
+
+
+_units_of_work = threading.local()
+
+# depth of the nested GhBase.transaction of each thread
+_transactions = threading.local()
+
+
+def current_unit_of_work():
+    """Return the UnitOfWork of the current thread or None """
+    return getattr(_units_of_work, "unit", None)
+
+
+@contextmanager
+def unit_of_work():
+    """Context manager deferring the cache writes of the current thread
+to its end (see UnitOfWork)
+
+Nested units of work join the outermost one. The deferred writes are
+flushed even if the block raises, as the data was received from
+github anyway.
+    """
+    unit = current_unit_of_work()
+    if unit is not None:
+        yield unit
+        return
+
+    unit = _units_of_work.unit = UnitOfWork()
+    try:
+        yield unit
+    finally:
+        _units_of_work.unit = None
+        unit.flush()
+
+
+def flush_unit_of_work():
+    """Write the deferred cache writes of the current thread, before the
+cache db is accessed directly.
+    """
+    unit = current_unit_of_work()
+    if unit is not None:
+        unit.flush()
+
+
+class MemoryCache(object):
+    """Bounded LRU tier of decoded cache db rows in front of the cache db
+
+Rows are written through to the cache db, which stays shared with the
+other processes. A row is kept with its stamp, the columns of the
+cache db telling its expiral time, validators and version, and is only
+served while the stamp of the row in the cache db is the same, so rows
+changed or expired by other processes (or by direct updates of the
+cache db) are read again. Checking the stamp is an indexed lookup,
+which spares reading and decoding the data.
+
+At most `max_entries` rows, which took about `max_bytes` in the cache
+db, are kept. Hits and misses are counted by `counter`, usually the
+name of the class of the node.
+    """
+
+    max_entries = 1000
+    max_bytes = 32*2**20
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.counters = dict()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a memory cache with the options memory_entries and
+memory_bytes of the "Cache DB" section, 0 entries disable it.
+        """
+        return cls(
+            max_entries=config_option(config, "Cache DB.memory_entries",
+                                      None),
+            max_bytes=config_option(config, "Cache DB.memory_bytes", None))
+
+    def get(self, key, counter, stamp):
+        """Return the row `key` or None, if it isn't kept or was kept with
+another `stamp`
+
+A row is kept as (stamp, size, value).
+        """
+        with self._lock:
+            counters = self.counters.setdefault(counter,
+                                                dict(hits=0, misses=0))
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] != tuple(stamp):
+                if entry is not None:
+                    self.bytes -= entry[1]
+                counters["misses"] += 1
+                return None
+
+            # move it to the end of the LRU order
+            self.entries[key] = entry
+            counters["hits"] += 1
+            return entry[2]
+
+    def put(self, key, value, stamp, size):
+        """Keep `value` of the row `key` with `stamp` """
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self.entries[key] = (tuple(stamp), size, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries \
+                    or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return {counter: {hits, misses}} and the overall usage """
+        with self._lock:
+            ret = dict((counter, dict(counters))
+                       for counter, counters in self.counters.iteritems())
+            ret[None] = dict(entries=len(self.entries), bytes=self.bytes)
+            return ret
+
+
+_memory_cache = dict()
+
+
+def memory_cache():
+    """Return the MemoryCache of the current process """
+    pid = os.getpid()
+    with _process_lock:
+        if pid not in _memory_cache:
+            _memory_cache.clear()
+            _memory_cache[pid] = MemoryCache.from_config(config)
+        return _memory_cache[pid]
+
+
+# Asynchronous calls on the dictionary tree run on a thread pool of
+# the process, sized by option async_workers of the Transport section.
+_async_pool = dict()
+
+
+def async_pool():
+    """Return the ThreadPool running asynchronous calls of this process """
+    pid = os.getpid()
+    with _process_lock:
+        if pid not in _async_pool:
+            _async_pool.clear()
+            _async_pool[pid] = ThreadPool(
+                config_option(config, "Transport.async_workers", 16))
+        return _async_pool[pid]
+
+
+def batch_concurrency():
+    """Return the number of mutations a batch sends at the same time """
+    return config_option(config, "Transport.batch_concurrency", 8)
+
+
+def run_batch(func, items, concurrency=None):
+    """Call func(item) for all `items` with up to `concurrency` threads
+
+Returns a list of (result, exception) tuples in the order of `items`,
+where exception is None if the call succeeded.
+    """
+    if concurrency is None:
+        concurrency = batch_concurrency()
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return (func(item), None)
+        except Exception as exc:
+            return (None, exc)
+
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.terminate()
 
 
 class GhBase(dict):
@@ -326,29 +1158,244 @@ Includes the classname and the parameters with their values. """
     def add(self, **arguments):
         raise NotImplementedError("Nothing to see here, move along")
 
+    def aget(self, key):
+        """Asynchronous self[key]
+
+Returns a multiprocessing.pool.AsyncResult, whose get() returns the
+child node (or raises the KeyError) once it has been fetched.
+        """
+        return async_pool().apply_async(self.__getitem__, (key,))
+
     expiral_time = 24*60*60
 
+    # the connection to the cache db of the current thread
+    sqlite = ThreadLocalConnection()
+    _sqlite_initialized = False
+
     @classmethod
     def init_sqlite(cls):
-        if hasattr(cls, "sqlite"):
-            return
+        with _process_lock:
+            if not GhBase._sqlite_initialized:
+                GhBase.create_tables()
+                GhBase._sqlite_initialized = True
+                collect_garbage_periodically()
 
-        try:
-            filepath = config["Cache DB.filepath"]
-        except KeyError:
-            filepath = "/tmp/githubcache.db"
+    @classmethod
+    def create_tables(cls):
+
+        # lets collect_garbage return the pages of deleted rows to the
+        # file system, only takes effect for new cache dbs or after a
+        # full vacuum
+        GhBase.sqlite.execute("pragma auto_vacuum = incremental")
+
+        # persists in the cache db
+        mode = journal_mode()
+        if not mode.isalpha():
+            raise ValueError("Invalid value of Cache DB.journal_mode: {}"
+                             .format(mode))
+        GhBase.sqlite.execute("pragma journal_mode = {}".format(mode)) \
+                     .fetchall()
+
+        GhBase.sqlite.execute("create table if not exists cache"
+                              "(identifier text, parameters text,"
+                              " expires integer, data blob,"
+                              " etag text, last_modified text,"
+                              " version integer not null default 0,"
+                              " primary key(identifier, parameters))")
+
+        # cache dbs created before conditional requests lack the
+        # validator columns
+        columns = [row[1] for row in
+                   GhBase.sqlite.execute("pragma table_info(cache)")]
+        for column in ("etag", "last_modified"):
+            if column not in columns:
+                GhBase.sqlite.execute("alter table cache add column {} text"
+                                      .format(column))
+        GhBase.sqlite.execute("create index if not exists cache_expires"
+                              " on cache(expires)")
+
+        # pages of paginated requests, `origin` is the key of the
+        # first page of the request
+        GhBase.sqlite.execute("create table if not exists pages"
+                              "(key text primary key, origin text,"
+                              " expires integer, etag text,"
+                              " last_modified text, link text, data blob)")
+        GhBase.sqlite.execute("create index if not exists pages_expires"
+                              " on pages(expires)")
+
+        # resources by their canonical api url, see store_entity
+        GhBase.sqlite.execute("create table if not exists entities"
+                              "(url text primary key, data blob,"
+                              " complete_expires integer,"
+                              " partial_expires integer,"
+                              " etag text, last_modified text,"
+                              " version integer not null default 0)")
+
+        # the version of the rows of the cache and the entity store is
+        # bumped by each write of their data (see ENTITY_VERSION), cache
+        # dbs created before the memory cache lack it
+        for table in ("cache", "entities"):
+            columns = [row[1] for row in GhBase.sqlite.execute(
+                "pragma table_info({})".format(table))]
+            if "version" not in columns:
+                GhBase.sqlite.execute("alter table {} add column version"
+                                      " integer not null default 0"
+                                      .format(table))
+        # partial_expires is never before complete_expires
+        GhBase.sqlite.execute("create index if not exists entities_expires"
+                              " on entities(partial_expires)")
+
+        # leases for refreshing cache rows, see acquire_lease
+        GhBase.sqlite.execute("create table if not exists leases"
+                              "(identifier text, parameters text,"
+                              " owner text, expires real,"
+                              " primary key(identifier, parameters))")
+
+        # the local index of issue and pull request payloads, see
+        # index_item and local_search. the index of older cache dbs
+        # kept copies of the payloads, it is rebuilt as they are seen
+        columns = [row[1] for row in
+                   GhBase.sqlite.execute("pragma table_info(items)")]
+        if columns and "url" not in columns:
+            GhBase.sqlite.execute("drop table items")
+        GhBase.sqlite.execute("create table if not exists items"
+                              "(repo text, kind text, number integer,"
+                              " url text, state text, assignee text,"
+                              " milestone integer, creator text,"
+                              " created_at text, updated_at text,"
+                              " comments integer,"
+                              " primary key(repo, kind, number))")
+        GhBase.sqlite.execute("create table if not exists item_labels"
+                              "(repo text, kind text, number integer,"
+                              " label text,"
+                              " primary key(repo, kind, number, label))")
+        for column in ("state", "assignee", "milestone", "creator",
+                       "created_at", "updated_at"):
+            GhBase.sqlite.execute("create index if not exists items_{0}"
+                                  " on items(repo, kind, {0})"
+                                  .format(column))
+        GhBase.sqlite.execute("create index if not exists item_labels_label"
+                              " on item_labels(repo, kind, label)")
+        GhBase.sqlite.execute("create index if not exists items_url"
+                              " on items(url)")
+
+        # the last runs of maintenance tasks, see collect_garbage
+        GhBase.sqlite.execute("create table if not exists maintenance"
+                              "(task text primary key, last_run real)")
+
+        # the highest `updated_at` of the resources of collections seen
+        # by their last refresh, see GhCollection.incremental_sync
+        GhBase.sqlite.execute("create table if not exists watermarks"
+                              "(identifier text, parameters text, since text,"
+                              " primary key(identifier, parameters))")
+
+        RateLimiter.create_table(GhBase.sqlite)
+
+        # cache dbs of older versions hold pickles
+        version = GhBase.sqlite.execute("pragma user_version").fetchone()[0]
+        if version < serialization.FORMAT_VERSION:
+            GhBase.migrate_cache_format()
 
-        cls.sqlite = sqlite3.connect(filepath,
-                                     isolation_level=None)
+    @classmethod
+    def migrate_cache_format(cls):
+        """Convert the data of the cache db to the current format of the
+serialization module.
+        """
+        with cls.transaction():
+            for table, compress in (("cache", False), ("entities", False),
+                                    ("pages", True)):
+                rows = cls.sqlite.execute("select rowid, data from {}"
+                                          .format(table)).fetchall()
+                for (rowid, data) in rows:
+                    blob = serialization.migrate(data, compress)
+                    if blob is not None:
+                        cls.sqlite.execute(
+                            "update {} set data=?{} where rowid=?"
+                            .format(table,
+                                    "" if table == "pages"
+                                    else ", version=version+1"),
+                            (buffer(blob), rowid))
+            cls.sqlite.execute("pragma user_version = {}"
+                               .format(serialization.FORMAT_VERSION))
 
-        cls.sqlite.execute("create table if not exists cache"
-                           "(identifier text, parameters text,"
-                           " expires integer, data blob,"
-                           " primary key(identifier, parameters))")
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        """Context manager grouping the cache writes of the current thread
+into one transaction of the cache db.
+
+The transaction takes the write lock of the cache db at its start,
+waiting up to busy_timeout for other connections to release it.
+Taking it on the first write instead fails immediately, if another
+connection wrote since the transaction began reading. Nested
+transactions join the outermost one.
+        """
+        depth = getattr(_transactions, "depth", 0)
+        _transactions.depth = depth + 1
+        try:
+            if depth > 0:
+                yield
+                return
+
+            cls.sqlite.execute("begin immediate")
+            try:
+                yield
+            except:
+                cls.sqlite.execute("rollback")
+                raise
+            cls.sqlite.execute("commit")
+        finally:
+            _transactions.depth = depth
 
     @classmethod
     def clear_cache(cls):
+        cls.init_sqlite()
         cls.sqlite.execute("delete from cache")
+        cls.sqlite.execute("delete from pages")
+        cls.sqlite.execute("delete from entities")
+        cls.sqlite.execute("delete from leases")
+        cls.sqlite.execute("delete from items")
+        cls.sqlite.execute("delete from item_labels")
+        cls.sqlite.execute("delete from maintenance")
+        cls.sqlite.execute("delete from watermarks")
+        memory_cache().clear()
+        if current_unit_of_work() is not None:
+            current_unit_of_work().clear()
+
+    def _cache_parameters(self):
+        """Return the joined version of self._parameters """
+        return ",".join("{}={}".format(k, v)
+                        for k, v in self._parameters.iteritems())
+
+    def _expiral_time(self):
+        """Return the configured expiral time of this class in seconds """
+        return int(class_option("Expiral time", self.__class__,
+                                self.expiral_time))
+
+    # whether the cached data of this class is compressed, set per class
+    # in config section "Compress cache"
+    compress_cache = False
+
+    def _compress(self):
+        """Return whether the cached data of this class is compressed """
+        return bool(int(class_option("Compress cache", self.__class__,
+                                     self.compress_cache)))
+
+    # seconds after the expiral time, during which the expired data is
+    # served while it is refreshed in the background, set per class in
+    # config section "Stale while revalidate"; 0 waits for the refresh
+    stale_while_revalidate = 0
+
+    def _stale_window(self):
+        """Return the configured stale-while-revalidate window of this class
+in seconds (limited by stale_retention).
+        """
+        return int(class_option("Stale while revalidate", self.__class__,
+                                self.stale_while_revalidate))
+
+    # ETag and Last-Modified header of the response the data was
+    # taken from, used to revalidate the data once it expired
+    _validators = (None, None)
 
     def serialize(self, identifier=None):
         '''Save dictionary items into sqlite table
@@ -358,48 +1405,816 @@ __class__.__name__ options. It falls back to attribute `expiral_time`
 (a day).
 
 a joined version of self._parameters is used as secondary key.
+Resources keep their data in the entity store instead (see
+GhResource.serialize).
 
 `identifier` -- String usually composed of class name
-                and perhaps a suffix like "_partial"
         '''
 
         if identifier is None:
             identifier = self.__class__.__name__
 
-        parameters = ",".join("{}={}".format(k, v)
-                              for k, v in self._parameters.iteritems())
-
-        try:
-            expiral_time = config["Expiral time"][self.__class__.__name__]
-        except KeyError:
-            expiral_time = self.expiral_time
-
         data = super(GhBase, self).items()
-        self.sqlite.execute("insert or replace into cache values (?,?,?,?)",
-                            (identifier, parameters,
-                             int(time.time() + expiral_time),
-                             buffer(pickle.dumps(data))))
-
-    def deserialize(self, identifier=None):
+        parameters = self._cache_parameters()
+        expires = int(time.time() + self._expiral_time())
+        blob = serialization.encode(data, self._compress())
+        row = (data, self._validators, expires)
+        # only the expiral time of an unchanged row is updated
+        touch = self._loaded is not None \
+            and [tuple(x) for x in self._loaded[0]] \
+            == [tuple(x) for x in data] \
+            and tuple(self._loaded[1]) == tuple(self._validators)
+
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.put_row(identifier, parameters, row, blob, touch)
+        elif touch:
+            self.sqlite.execute("update cache set expires=?"
+                                " where identifier=? and parameters=?",
+                                (expires, identifier, parameters))
+        else:
+            self.sqlite.execute("insert or replace into cache"
+                                " (identifier, parameters, expires, data,"
+                                "  etag, last_modified, version)"
+                                " values (?,?,?,?,?,?," + CACHE_VERSION + ")",
+                                (identifier, parameters, expires,
+                                 buffer(blob))
+                                + tuple(self._validators)
+                                + (identifier, parameters))
+        if unit is None:
+            (version,) = self.sqlite.execute(
+                "select version from cache"
+                " where identifier=? and parameters=?",
+                (identifier, parameters)).fetchone()
+            memory_cache().put(("cache", identifier, parameters),
+                               (data, self._validators),
+                               (expires,) + tuple(self._validators)
+                               + (version,), len(blob))
+        self._loaded = (data, self._validators)
+
+    # (data, validators) of the cache row of this node, as last loaded
+    # or stored, to tell whether serialize changes it
+    _loaded = None
+
+    def deserialize(self, identifier=None, stale=False):
+        """Load the cached data of this node
+
+Returns whether a row was found. Expired rows are only considered
+with `stale` (True or the number of seconds since they expired).
+        """
         if identifier is None:
             identifier = self.__class__.__name__
+        parameters = self._cache_parameters()
+
+        unit = current_unit_of_work()
+        if unit is not None and (identifier, parameters) in unit.rows:
+            (data, validators, expires) = \
+                unit.rows[(identifier, parameters)][0]
+            if expires < expiry_cutoff(stale):
+                return False
+            self._load_row(data, validators)
+            return True
+
+        # expired rows are deleted by collect_garbage
+        stamp = self.sqlite.execute(
+            'select expires, etag, last_modified, version from cache'
+            ' where identifier=? and parameters=?',
+            (identifier, parameters)).fetchone()
+        if stamp is None or stamp[0] < expiry_cutoff(stale):
+            return False
 
-        self.sqlite.execute("delete from cache where expires < ?",
-                            (time.time(),))
-        c = self.sqlite.cursor()
+        key = ("cache", identifier, parameters)
+        cached = memory_cache().get(key, identifier, stamp)
+        if cached is not None:
+            self._load_row(*cached)
+            return True
 
-        parameters = ",".join("{}={}".format(k, v)
-                              for k, v in self._parameters.iteritems())
-        c.execute('select data from cache where identifier=? and parameters=?',
-                  (identifier, parameters))
-        row = c.fetchone()
+        row = self.sqlite.execute(
+            'select data, expires, etag, last_modified, version from cache'
+            ' where identifier=? and parameters=? and expires >= ?',
+            (identifier, parameters, expiry_cutoff(stale))).fetchone()
         if row is None:
             return False
         else:
-            data = pickle.loads(row[0])
+            data = serialization.decode(row[0])
+            validators = (row[2], row[3])
+            memory_cache().put(key, (data, validators), row[1:],
+                               len(row[0]))
+            self._load_row(data, validators)
+            return True
+
+    def _load_row(self, data, validators):
+        self._validators = validators
+        self._loaded = (data, validators)
+        super(GhBase, self).update(data)
+
+    def acquire_lease(self, identifier=None, parameters=None):
+        """Try to take the lease for refreshing the row of this node (or
+the row `identifier`, `parameters` of it, f.ex. a cached query)
+
+Only one thread of all processes sharing the cache db gets the lease
+until it is released or `lease_time` passed. Returns True, if the
+calling thread got it.
+        """
+        if identifier is None:
+            identifier = self.__class__.__name__
+        if parameters is None:
+            parameters = self._cache_parameters()
+
+        now = time.time()
+        self.sqlite.execute("begin immediate")
+        try:
+            row = self.sqlite.execute(
+                'select expires from leases'
+                ' where identifier=? and parameters=?',
+                (identifier, parameters)).fetchone()
+            if row is not None and row[0] >= now:
+                return False
+
+            self.sqlite.execute("insert or replace into leases"
+                                " values (?,?,?,?)",
+                                (identifier, parameters, lease_owner(),
+                                 now + lease_time()))
+            return True
+        finally:
+            self.sqlite.execute("commit")
+
+    def release_lease(self, identifier=None, parameters=None):
+        if identifier is None:
+            identifier = self.__class__.__name__
+        if parameters is None:
+            parameters = self._cache_parameters()
+
+        # the rows of the refresh are written with the unit of work of
+        # the thread, the processes waiting for them fall back to the
+        # stale rows meanwhile
+        self.sqlite.execute("delete from leases"
+                            " where identifier=? and parameters=? and owner=?",
+                            (identifier, parameters, lease_owner()))
+
+    def lease_refresh(self):
+        """Try to take the lease for refreshing the expired row of this node
+
+Returns True with the lease, False if another thread or process holds
+it and None if there is no row to refresh: the first fetches of a node
+don't take leases, concurrent ones of a process share their request
+anyway (see github_request).
+        """
+        if not self._has_cached_row():
+            return None
+        return self.acquire_lease()
+
+    def _has_cached_row(self, identifier=None):
+        """Whether the cache db (or the unit of work of the thread) has a
+row of this node, expired or not
+        """
+        if identifier is None:
+            identifier = self.__class__.__name__
+        key = (identifier, self._cache_parameters())
 
-            super(GhBase, self).update(data)
+        unit = current_unit_of_work()
+        if unit is not None and key in unit.rows:
             return True
+        return self.sqlite.execute(
+            'select 1 from cache where identifier=? and parameters=?',
+            key).fetchone() is not None
+
+    def wait_for_refresh(self, identifier=None):
+        """Wait for the holder of the lease to write the fresh row of this
+node and load it.
+
+Waits up to `lease_wait` seconds and falls back to the stale row.
+Returns True, if data was loaded.
+        """
+        if identifier is None:
+            identifier = self.__class__.__name__
+
+        deadline = time.time() + lease_wait()
+        while time.time() < deadline:
+            time.sleep(0.05)
+            if self.deserialize():
+                return True
+
+            leased = self.sqlite.execute(
+                'select 1 from leases where identifier=? and parameters=?',
+                (identifier, self._cache_parameters())).fetchone()
+            if leased is None:
+                # the holder gave up
+                break
+
+        return self.deserialize(stale=True)
+
+    def invalidate_dependents(self, added=(), deleted=()):
+        """Update the cached nodes depending on this node after a change
+
+Called after this resource was changed, or the resources `added`
+((key, value) items as cached by the collection) were added to or the
+keys `deleted` were deleted from this collection. See depends_on.
+        """
+        flush_unit_of_work()
+        for dependency in _dependents.get(self.__class__.__name__, ()):
+            dependency.invalidate(self._parameters, added, deleted)
+
+
+def expiry_cutoff(stale=False):
+    """Return the earliest expiral time of data, which may be served
+
+That is now, or with `stale` (True or a number of seconds) also data
+which expired that long ago.
+    """
+    if stale is True:
+        return 0
+    return time.time() - (stale or 0)
+
+
+# the refreshes of stale data started by revalidate_in_background
+_revalidations = []
+
+
+def revalidate_in_background(func):
+    """Call func() to refresh stale data in a thread of the async pool """
+    with _process_lock:
+        _revalidations[:] = [x for x in _revalidations if not x.ready()]
+        _revalidations.append(async_pool().apply_async(func))
+
+
+def wait_for_revalidations(timeout=None):
+    """Wait up to `timeout` seconds for the background refreshes to write
+their data back, f.ex. before the process exits.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with _process_lock:
+        pending = list(_revalidations)
+    for result in pending:
+        result.wait(None if deadline is None
+                    else max(deadline - time.time(), 0))
+
+
+def revalidation_wait():
+    """Seconds the cli waits for background refreshes when it exits """
+    return config_option(config, "Cache DB.revalidation_wait", 10, float)
+
+
+def stale_retention():
+    """Seconds expired rows are kept to be served while being refreshed """
+    return config_option(config, "Cache DB.stale_retention", 60*60)
+
+
+def lease_time():
+    """Seconds after which an unreleased refresh lease is void """
+    return config_option(config, "Cache DB.lease_time", 30)
+
+
+def lease_wait():
+    """Seconds to wait for another process refreshing a row """
+    return config_option(config, "Cache DB.lease_wait", 2, float)
+
+
+def lease_owner():
+    return "{}:{}".format(os.getpid(), threading.current_thread().ident)
+
+
+def page_retention():
+    """Seconds a cached page is kept since it was last confirmed """
+    return config_option(config, "Cache DB.page_retention", 7*24*60*60)
+
+
+def cached_pages(origin):
+    """Return {key: (etag, last_modified, link)} of the cached pages of
+the paginated request starting at `origin`.
+    """
+    GhBase.init_sqlite()
+    return dict((row[0], row[1:])
+                for row in GhBase.sqlite.execute(
+                    'select key, etag, last_modified, link from pages'
+                    ' where origin=?', (origin,)))
+
+
+def cached_page(key):
+    """Return (etag, last_modified, link, items) of a cached page or None """
+    GhBase.init_sqlite()
+    row = GhBase.sqlite.execute('select etag, last_modified, link, data'
+                                ' from pages where key=?',
+                                (key,)).fetchone()
+    if row is None:
+        return None
+    return row[:3] + (serialization.decode(row[3]),)
+
+
+def store_page(key, origin, headers, items):
+    """Cache the page `key`, if github sent validators for it """
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+    if etag is None and last_modified is None:
+        return
+
+    GhBase.init_sqlite()
+    GhBase.sqlite.execute("insert or replace into pages"
+                          " (key, origin, expires, etag, last_modified,"
+                          "  link, data) values (?,?,?,?,?,?,?)",
+                          (key, origin, int(time.time() + page_retention()),
+                           etag, last_modified, headers.get("Link"),
+                           buffer(serialization.encode(items, True))))
+
+
+def touch_page(key, link):
+    """Bump the retention time of a page, which github confirmed, and keep
+the `link` to the pages after it
+    """
+    GhBase.sqlite.execute("update pages set expires=?, link=? where key=?",
+                          (int(time.time() + page_retention()), link, key))
+
+
+class CachedData(Mapping):
+    """Data of a resource loaded from the entity store
+
+A resource instantiated with it doesn't store it again. `complete`
+tells whether it is the detailed representation of the resource. The
+data is wrapped rather than copied, so the fields of a lazily stored
+resource (see serialization.LazyMapping) are only decoded on access.
+    """
+
+    def __init__(self, data, complete):
+        self.data = data
+        self.complete = complete
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+def load_entity(url, stale=False, counter="entities"):
+    """Return (data, complete, validators) of the cached resource with the
+canonical api `url` or None
+
+Expired data is only returned with `stale` (True or the number of
+seconds since it expired). `complete` tells whether the data is the
+detailed representation of the resource, rather than the summary of a
+list page; data is a CachedData. Lookups in the memory cache are
+counted by `counter`.
+    """
+    row = entity_row(url, counter)
+    if row is None:
+        return None
+
+    (data, complete_expires, partial_expires, etag, last_modified) = row
+    cutoff = expiry_cutoff(stale)
+    if complete_expires >= cutoff and complete_expires > 0:
+        complete = True
+    elif partial_expires >= cutoff:
+        complete = False
+    else:
+        return None
+    return (CachedData(data, complete), complete, (etag, last_modified))
+
+
+def entity_row(url, counter="entities"):
+    """Return the decoded row (data, complete_expires, partial_expires,
+etag, last_modified) of the entity `url` or None
+
+Rows which didn't change in the cache db are taken from the memory
+cache, rows deferred by the unit of work of the thread are taken from
+it.
+    """
+    unit = current_unit_of_work()
+    if unit is not None and url in unit.entities:
+        return unit.entities[url][0]
+
+    GhBase.init_sqlite()
+    stamp = GhBase.sqlite.execute(
+        'select complete_expires, partial_expires, etag, last_modified,'
+        ' version from entities where url=?', (url,)).fetchone()
+    if stamp is None:
+        return None
+    row = memory_cache().get(("entities", url), counter, stamp)
+    if row is not None:
+        return row
+
+    stored = GhBase.sqlite.execute(
+        'select data, complete_expires, partial_expires, etag,'
+        ' last_modified, version from entities where url=?',
+        (url,)).fetchone()
+    if stored is None:
+        return None
+    row = (serialization.decode(stored[0]),) + tuple(stored[1:5])
+    memory_cache().put(("entities", url), row, stored[1:], len(stored[0]))
+    return row
+
+
+def store_entity(url, data, complete, expires, validators=(None, None),
+                 compress=False, lazy=False):
+    """Cache the resource with the canonical api `url`
+
+Complete `data` replaces the cached resource. Partial `data` (f.ex.
+from a list page) is merged into the fresh cached resource, which
+stays complete as long as its complete data doesn't expire. The data
+is stored compressed with `compress` and to be decoded field by field
+with `lazy`.
+
+Returns (data, complete) of the cached resource after the merge.
+    """
+    GhBase.init_sqlite()
+    db = GhBase.sqlite
+    now = time.time()
+    (complete_expires, partial_expires) = (expires if complete else 0,
+                                           expires)
+    row = entity_row(url)
+    if not complete and row is not None and max(row[1], row[2]) >= now:
+        merged = dict(row[0])
+        merged.update(data)
+        (data, validators) = (merged, tuple(row[3:]))
+        if row[1] >= now:
+            # the merged data expires with the complete data
+            (complete_expires, partial_expires) = (row[1], row[1])
+
+    blob = serialization.encode(data, compress, lazy)
+    stored = (data, complete_expires, partial_expires) + tuple(validators)
+    # only the expiral time of an unchanged row is updated
+    touch = row is not None and tuple(row[3:]) == tuple(validators) \
+        and row[0] == data
+
+    unit = current_unit_of_work()
+    if unit is not None:
+        unit.put_entity(url, stored, blob, touch)
+    elif touch:
+        db.execute("update entities set complete_expires=?,"
+                   " partial_expires=? where url=?",
+                   (complete_expires, partial_expires, url))
+    else:
+        db.execute("insert or replace into entities"
+                   " (url, data, complete_expires, partial_expires, etag,"
+                   "  last_modified, version)"
+                   " values (?,?,?,?,?,?," + ENTITY_VERSION + ")",
+                   (url, buffer(blob), complete_expires, partial_expires)
+                   + tuple(validators) + (url,))
+    if unit is None:
+        (version,) = db.execute("select version from entities where url=?",
+                                (url,)).fetchone()
+        memory_cache().put(("entities", url), stored,
+                           stored[1:] + (version,), len(blob))
+    return (data, complete_expires >= now)
+
+
+def revalidate_entity(url, expires):
+    """Bump the expiral time of the complete data of the cached resource
+`url`, after github confirmed it.
+    """
+    flush_unit_of_work()
+    GhBase.sqlite.execute("update entities set complete_expires=?,"
+                          " partial_expires=max(partial_expires, ?)"
+                          " where url=?", (expires, expires, url))
+    memory_cache().discard(("entities", url))
+
+
+def confirm_entities(urls, expires):
+    """Bump the expiral time of the cached data of the resources `urls`,
+after github reported no changes of them.
+
+Returns whether all of them are cached.
+    """
+    flush_unit_of_work()
+    with GhBase.transaction():
+        confirmed = sum(GhBase.sqlite.execute(
+            "update entities set partial_expires=max(partial_expires, ?)"
+            " where url=?", (expires, url)).rowcount for url in urls)
+    for url in urls:
+        memory_cache().discard(("entities", url))
+    return confirmed == len(urls)
+
+
+def index_item(kind, repo, url, data):
+    """Keep the issue or pull request payload `data` in the local index
+
+`kind` is "issues" or "pulls", `repo` is "<user>/<repo>" and `url` the
+key of the payload in the entity store. The filter fields are stored
+in indexed columns, so local_search can answer queries without asking
+github.
+    """
+    number = data.get("number")
+    if number is None:
+        return
+
+    def login(field):
+        return (data.get(field) or dict()).get("login")
+
+    row = (repo, kind, number, url, data.get("state"), login("assignee"),
+           (data.get("milestone") or dict()).get("number"),
+           login("user"), data.get("created_at"), data.get("updated_at"),
+           data.get("comments"))
+    labels = ([label["name"] for label in data["labels"]]
+              if "labels" in data else None)
+
+    unit = current_unit_of_work()
+    if unit is not None:
+        unit.put_item(row, labels)
+        return
+
+    GhBase.init_sqlite()
+    db = GhBase.sqlite
+    with GhBase.transaction():
+        db.execute("insert or replace into items"
+                   " values (?,?,?,?,?,?,?,?,?,?,?)", row)
+        if labels is not None:
+            db.execute("delete from item_labels"
+                       " where repo=? and kind=? and number=?",
+                       (repo, kind, number))
+            db.executemany("insert or ignore into item_labels"
+                           " values (?,?,?,?)",
+                           [(repo, kind, number, label)
+                            for label in labels])
+
+
+def local_search(kind, repo, filters):
+    """Generator over the indexed payloads of `kind` in `repo` matching
+`filters`
+
+Understands the filters of github's issue and pull request listings
+(state, assignee, creator, milestone, labels, since, sort and
+direction) and `limit`. Without a state all payloads match, as for the
+collections. Raises ValueError for other filters.
+
+The payloads are the latest ones of the entity store, the index isn't
+refreshed from github.
+    """
+    filters = dict(filters)
+    where = ["items.repo=?", "items.kind=?"]
+    args = [repo, kind]
+
+    state = filters.pop("state", "all")
+    if state != "all":
+        where.append("state=?")
+        args.append(state)
+
+    for name in ("assignee", "creator", "milestone"):
+        if name not in filters:
+            continue
+        value = filters.pop(name)
+        if value == "none":
+            where.append(name + " is null")
+        elif value == "*":
+            where.append(name + " is not null")
+        else:
+            where.append(name + "=?")
+            args.append(value)
+
+    labels = filters.pop("labels", None)
+    if labels:
+        for label in labels.split(","):
+            where.append("exists (select 1 from item_labels l"
+                         " where l.repo=items.repo and l.kind=items.kind"
+                         " and l.number=items.number and l.label=?)")
+            args.append(label.strip())
+
+    if "since" in filters:
+        where.append("updated_at >= ?")
+        args.append(filters.pop("since"))
+
+    try:
+        order = dict(created="created_at", updated="updated_at",
+                     comments="comments")[filters.pop("sort", "created")]
+        direction = dict(asc="asc", desc="desc")[
+            filters.pop("direction", "desc")]
+    except KeyError as e:
+        raise ValueError("Can't sort by {} locally".format(e.args[0]))
+
+    limit = int(filters.pop("limit", -1))
+    if filters:
+        raise ValueError("Can't filter by {} locally"
+                         .format(", ".join(sorted(filters))))
+
+    GhBase.init_sqlite()
+    query = ("select entities.data, entities.complete_expires from items"
+             " join entities on entities.url=items.url where " +
+             " and ".join(where) +
+             " order by {0} {1}, number {1} limit ?".format(order, direction))
+    now = time.time()
+    flush_unit_of_work()
+    for row in GhBase.sqlite.execute(query, args + [limit]).fetchall():
+        yield CachedData(serialization.decode(row[0]), row[1] >= now)
+
+
+def gc_interval():
+    """Seconds between the garbage collections started when a process
+opens the cache db, 0 disables them.
+    """
+    return config_option(config, "Cache DB.gc_interval", 24*60*60)
+
+
+# the tables of the cache db by the column telling when a row expires
+_expiring_tables = (("cache", "expires"),
+                    ("entities", "partial_expires"),
+                    ("pages", "expires"),
+                    ("leases", "expires"))
+
+
+def collect_garbage(vacuum=False):
+    """Delete the expired data from the cache db
+
+Expired rows are kept stale_retention seconds to be served while
+another process refreshes them, rows with validators page_retention
+seconds to be revalidated. Returns {table: number of deleted rows}.
+
+The space of the deleted rows is returned to the file system, with
+`vacuum` by rewriting the whole db.
+    """
+    GhBase.init_sqlite()
+    flush_unit_of_work()
+    db = GhBase.sqlite
+    now = time.time()
+    deleted = dict()
+    with GhBase.transaction():
+        for table, column in _expiring_tables:
+            if table in ("cache", "entities"):
+                condition = ("{0} < ? and etag is null"
+                             " and last_modified is null or {0} < ?")
+                args = (now - stale_retention(), now - page_retention())
+            else:
+                condition = "{0} < ?"
+                args = (now,)
+            deleted[table] = db.execute(
+                "delete from {} where ".format(table)
+                + condition.format(column), args).rowcount
+
+        # the local index of deleted resources
+        deleted["items"] = db.execute(
+            "delete from items"
+            " where url not in (select url from entities)").rowcount
+        deleted["item_labels"] = db.execute(
+            "delete from item_labels where not exists"
+            " (select 1 from items where items.repo=item_labels.repo"
+            "  and items.kind=item_labels.kind"
+            "  and items.number=item_labels.number)").rowcount
+
+        db.execute("insert or replace into maintenance values (?,?)",
+                   ("gc", now))
+
+    if vacuum:
+        db.execute("vacuum")
+    else:
+        # frees one page per step
+        db.execute("pragma incremental_vacuum").fetchall()
+    # shrinks the write-ahead log, which is only reset once no
+    # connection reads from it
+    db.execute("pragma wal_checkpoint(truncate)").fetchall()
+    return deleted
+
+
+def collect_garbage_periodically():
+    """collect_garbage, if it didn't run for gc_interval seconds """
+    interval = gc_interval()
+    if not interval:
+        return
+    row = GhBase.sqlite.execute("select last_run from maintenance"
+                                " where task=?", ("gc",)).fetchone()
+    if row is None or row[0] < time.time() - interval:
+        collect_garbage()
+
+
+def cache_usage():
+    """Return the size of the cache db
+
+Returns a dict with the `size` of the db and its `free` space in bytes
+and the number of `rows` of every table.
+    """
+    GhBase.init_sqlite()
+    flush_unit_of_work()
+    db = GhBase.sqlite
+    page_size = db.execute("pragma page_size").fetchone()[0]
+    tables = [row[0] for row in db.execute(
+        "select name from sqlite_master where type='table'"
+        " and name not like 'sqlite_%' order by name")]
+    return dict(
+        size=db.execute("pragma page_count").fetchone()[0] * page_size,
+        free=db.execute("pragma freelist_count").fetchone()[0] * page_size,
+        rows=dict((table, db.execute("select count(*) from {}"
+                                     .format(table)).fetchone()[0])
+                  for table in tables))
+
+
+_dependents = dict()
+
+
+def depends_on(dependent, node_class, parameters=(), action="expire"):
+    """Declare that the cached nodes of class `dependent` change with the
+nodes of `node_class`
+
+The cached nodes are matched by the `parameters` they share with the
+changed node, the others are ignored. After a change the `action`
+taken on the matching cached nodes is
+
+  "expire"   resources are expired and refreshed on their next access,
+             collections expire their keys and forget their counts and
+             search results
+  "patch"    collections add or remove the keys of the added or deleted
+             resources; they expire their keys only if they can't tell
+             whether an added resource belongs to them, since they
+             aren't identified by `parameters`
+  "queries"  collections forget their counts and search results
+
+Expired data is kept, so that incremental_sync continues from it.
+    """
+    _dependents.setdefault(node_class.__name__, []).append(
+        Dependency(dependent, parameters, action))
+
+
+def parse_cache_parameters(parameters):
+    """Return the dictionary of the joined `parameters` of a cache row """
+    return dict(x.split("=", 1)
+                for x in parameters.split("|", 1)[0].split(",") if x)
+
+
+class Dependency(object):
+    """Cached nodes of class `dependent` depending on another node class,
+see depends_on.
+    """
+
+    def __init__(self, dependent, parameters, action):
+        self.dependent = dependent
+        self.parameters = parameters
+        self.action = action
+
+    def invalidate(self, parameters, added=(), deleted=()):
+        """Apply the action to the cached nodes matching `parameters` of
+the changed node
+        """
+        match = dict((k, str(parameters[k])) for k in self.parameters
+                     if k in parameters)
+        if issubclass(self.dependent, GhResource):
+            self.expire_entity(match)
+            return
+
+        identifier = self.dependent.__name__
+        self.forget_queries(identifier, match)
+        if self.action == "queries":
+            return
+        for row in self.matching_rows(identifier, match):
+            if self.action == "expire":
+                self.expire_keys(identifier, row)
+            elif added and not set(parse_cache_parameters(row)) <= set(match):
+                # the added resources may not belong to the collection
+                self.expire_keys(identifier, row)
+            elif added or deleted:
+                self.patch_keys(identifier, row, added, deleted)
+
+    def matching_rows(self, identifier, match):
+        """Return the parameters of the cache rows of `identifier`, which
+match the parameters `match`
+        """
+        return [row for (row,) in GhBase.sqlite.execute(
+                    "select parameters from cache where identifier=?",
+                    (identifier,)).fetchall()
+                if all(parse_cache_parameters(row).get(k) == v
+                       for k, v in match.iteritems())]
+
+    def forget_queries(self, identifier, match):
+        for kind in ("_count", "_search"):
+            for row in self.matching_rows(identifier + kind, match):
+                GhBase.sqlite.execute("delete from cache"
+                                      " where identifier=? and parameters=?",
+                                      (identifier + kind, row))
+
+    def expire_keys(self, identifier, row):
+        GhBase.sqlite.execute("update cache set expires=0"
+                              " where identifier=? and parameters=?",
+                              (identifier, row))
+        memory_cache().discard(("cache", identifier, row))
+
+    def patch_keys(self, identifier, row, added, deleted):
+        """Add the `added` items to and remove the `deleted` keys from the
+cached keys of the collection `row`
+        """
+        (blob,) = GhBase.sqlite.execute(
+            "select data from cache where identifier=? and parameters=?",
+            (identifier, row)).fetchone()
+        deleted = set(str(key) for key in deleted)
+        items = [(key, value) for key, value in serialization.decode(blob)
+                 if str(key) not in deleted]
+        cached = set(str(key) for key, value in items)
+        items.extend((key, value) for key, value in added
+                     if str(key) not in cached)
+        compress = bool(int(class_option("Compress cache", self.dependent,
+                                         self.dependent.compress_cache)))
+        GhBase.sqlite.execute("update cache set data=?, version=version+1"
+                              " where identifier=? and parameters=?",
+                              (buffer(serialization.encode(items, compress)),
+                               identifier, row))
+        memory_cache().discard(("cache", identifier, row))
+
+    def expire_entity(self, match):
+        """Expire the cached resource identified by `match` """
+        try:
+            url = URL_BASE + self.dependent.url_template.format(**match)
+        except KeyError:
+            # the changed node doesn't identify a single resource
+            return
+        GhBase.sqlite.execute("update entities set complete_expires=0,"
+                              " partial_expires=0 where url=?", (url,))
+        memory_cache().discard(("entities", url))
 
 
 class GhResource(GhBase):
@@ -426,34 +2241,259 @@ should be overwritten by child classes.
     def __init__(self, parent, data=None, **kwargs):
         super(GhResource, self).__init__(parent, data, **kwargs)
 
-        if data is not None:
+        if isinstance(data, CachedData):
+            # taken from the entity store, nothing to store again
+            self._is_partial = not data.complete
+            self._load(data)
+        elif data is not None:
             self._is_partial = True
             super(GhResource, self).update(data)
             self.serialize()
         else:
             # self.complete_data raises ValueError if it couldn't
             # fetch the resource
-            self.deserialize() or self.complete_data()
+            self.deserialize() or self.revalidate_stale() or self.refresh()
+
+    # kind of the local index ("issues" or "pulls") the data of this
+    # class is kept in, see index_item
+    index_kind = None
+
+    # whether the fields of the cached data of this class are decoded
+    # only on access, set per class in config section "Lazy cache"
+    lazy_cache = False
+
+    # the LazyMapping with the fields loaded from the cache, which are
+    # not overridden by the dictionary of the resource
+    _lazy = None
+
+    def _lazy_cache(self):
+        """Return whether the cached data of this class is decoded lazily """
+        return bool(int(class_option("Lazy cache", self.__class__,
+                                     self.lazy_cache)))
+
+    def _load(self, data):
+        """Update the data of the resource with data from the cache
+
+The fields of a LazyMapping are kept in it, until they are accessed.
+        """
+        if isinstance(data, CachedData):
+            data = data.data
+        if not isinstance(data, serialization.LazyMapping):
+            super(GhResource, self).update(data)
+            return
+
+        for key in self._lazy_keys():
+            if key not in data:
+                super(GhResource, self).__setitem__(key, self._lazy[key])
+        for key in data:
+            super(GhResource, self).pop(key, None)
+        self._lazy = data
+
+    def _lazy_keys(self):
+        """Return the keys of the fields, which are only in self._lazy """
+        if self._lazy is None:
+            return []
+        return [key for key in self._lazy
+                if not super(GhResource, self).__contains__(key)]
+
+    def _field(self, key):
+        """Return the field `key` of the data, without completing it """
+        try:
+            return super(GhResource, self).__getitem__(key)
+        except KeyError:
+            if self._lazy is None:
+                raise
+            return self._lazy[key]
+
+    def __contains__(self, key):
+        return super(GhResource, self).__contains__(key) \
+            or self._lazy is not None and key in self._lazy
+
+    def iterkeys(self):
+        return chain(super(GhResource, self).iterkeys(), self._lazy_keys())
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        return (self._field(key) for key in self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        return ((key, self._field(key)) for key in self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __len__(self):
+        return super(GhResource, self).__len__() + len(self._lazy_keys())
+
+    def get(self, key, default=None):
+        return self._field(key) if key in self else default
+
+    def _entity_url(self):
+        """Return the canonical api url of the resource, the key of its data
+in the entity store (see store_entity).
+
+Resources without url_template (f.ex. the members of a team) have
+none; they keep their data in cache rows of their own.
+        """
+        try:
+            template = self.url_template
+        except NotImplementedError:
+            return None
+        return URL_BASE + template.format(**self._parameters)
+
+    def _row_identifier(self, partial):
+        """Return the identifier of the cache row of a resource without
+canonical url
+        """
+        return self.__class__.__name__ + ("_partial" if partial else "")
 
     def serialize(self):
-        super(GhResource, self).serialize(self.__class__.__name__ +
-                                          ("_partial"
-                                           if self._is_partial else ""))
+        """Store the data in the entity store
 
-    def deserialize(self):
-        if super(GhResource, self).deserialize(self.__class__.__name__):
+The data is shared with all nodes of the same resource, f.ex. an issue
+listed by the issues of the user and of the repository. If the
+resource is partial, its data is merged into the cached complete data,
+which the resource takes over then.
+        """
+        url = self._entity_url()
+        if url is None:
+            super(GhResource, self).serialize(
+                self._row_identifier(self._is_partial))
+            return
+
+        (data, complete) = store_entity(url,
+                                        dict(self.iteritems()),
+                                        not self._is_partial,
+                                        int(time.time() +
+                                            self._expiral_time()),
+                                        self._validators,
+                                        self._compress(),
+                                        self._lazy_cache())
+        if complete and self._is_partial:
+            super(GhResource, self).update(data)
             self._is_partial = False
-            return True
-        elif super(GhResource, self).deserialize(self.__class__.__name__
-                                                 + "_partial"):
-            self._is_partial = True
+
+        if self.index_kind is not None:
+            index_item(self.index_kind,
+                       "{user}/{repo}".format(**self._parameters),
+                       url, data)
+
+    def deserialize(self, stale=False):
+        """Load the cached data of this resource
+
+Returns whether data was found. Expired data is only considered with
+`stale`.
+        """
+        if self._entity_url() is None:
+            for partial in (False, True):
+                if super(GhResource, self).deserialize(
+                        self._row_identifier(partial), stale):
+                    self._is_partial = partial
+                    return True
+            return False
+
+        entity = load_entity(self._entity_url(), stale,
+                             self.__class__.__name__)
+        if entity is None:
+            return False
+
+        (data, complete, self._validators) = entity
+        self._load(data)
+        self._is_partial = not complete
+        return True
+
+    def expired_validators(self):
+        """Return (etag, last_modified) of the expired complete data of this
+resource
+
+Returns None, if there is none or it lacks both validators.
+        """
+        if self._entity_url() is None:
+            return None
+        entity = load_entity(self._entity_url(), stale=True)
+        if entity is None or not entity[1] or entity[2] == (None, None):
+            return None
+        return entity[2]
+
+    def revalidated(self):
+        """Load the expired data of this resource after github confirmed it
+with a 304 Not Modified and bump its expiral time.
+        """
+        url = self._entity_url()
+        revalidate_entity(url, int(time.time() + self._expiral_time()))
+        (data, complete, self._validators) = load_entity(url)
+        self._load(data)
+
+    def revalidate_stale(self):
+        """Load the data of this resource, if it expired less than its
+stale-while-revalidate window ago, and refresh it in the background.
+
+The resource is updated in place, once the refresh finished. Returns
+whether stale data was loaded.
+        """
+        window = self._stale_window()
+        if not window or not self.deserialize(stale=window):
+            return False
+
+        def refresh():
+            # nothing to do, if another thread or process refreshes it
+            if self.acquire_lease():
+                try:
+                    self.complete_data()
+                finally:
+                    self.release_lease()
+
+        revalidate_in_background(refresh)
+        return True
+
+    def refresh(self):
+        """complete_data, unless another thread or process is already
+refreshing this resource; then its result is awaited.
+        """
+        leased = self.lease_refresh()
+        if leased is False and self.wait_for_refresh():
             return True
 
-        return False
+        try:
+            return self.complete_data()
+        finally:
+            if leased:
+                self.release_lease()
+
+    def _has_cached_row(self, identifier=None):
+        url = self._entity_url()
+        if url is None:
+            return any(super(GhResource, self)._has_cached_row(
+                self._row_identifier(partial)) for partial in (False, True))
+
+        unit = current_unit_of_work()
+        if unit is not None and url in unit.entities:
+            return True
+        return self.sqlite.execute('select 1 from entities where url=?',
+                                   (url,)).fetchone() is not None
 
     def complete_data(self):
         url = self.url_template.format(**self._parameters)
-        req = github_request("GET", url)
+
+        # an expired complete representation is revalidated
+        validators = self.expired_validators()
+        req = github_request("GET", url,
+                             headers=None
+                             if validators is None
+                             else conditional_headers(*validators))
+
+        if validators is not None \
+           and '304 Not Modified' in req.headers["status"]:
+            self.revalidated()
+            self._is_partial = False
+            return True
 
         if '200 OK' not in req.headers["status"]:
             raise ValueError("Couldn't fetch {} object: {}"
@@ -461,17 +2501,19 @@ should be overwritten by child classes.
 
         super(GhResource, self).update(req.json())
         self._is_partial = False
+        self._validators = (req.headers.get("ETag"),
+                            req.headers.get("Last-Modified"))
         self.serialize()
         return True
 
     def __getitem__(self, key):
         self._debug("__getitem__", key)
         try:
-            return super(GhResource, self).__getitem__(key)
+            return self._field(key)
         except KeyError:
             if self._is_partial:
                 self.complete_data()
-                return super(GhResource, self).__getitem__(key)
+                return self._field(key)
             else:
                 raise
 
@@ -479,7 +2521,27 @@ should be overwritten by child classes.
         self._debug("__setitem__", key, value)
         self.update({key: value})
 
+    def aupdate(self, data):
+        """Asynchronous update(data)
+
+Returns a multiprocessing.pool.AsyncResult; the resource must not be
+changed otherwise until its get() returned.
+        """
+        return async_pool().apply_async(self.update, (data,))
+
     def update(self, data):
+        self._updated(self._patch(data))
+        self.serialize()
+        if isinstance(self._parent, GhCollection):
+            self._parent._forget_queries()
+        self.invalidate_dependents()
+
+    def _patch(self, data):
+        """Send `data` as PATCH request for this resource to github
+
+Returns the updated representation, without changing the resource.
+Raises KeyError, if github doesn't know the resource.
+        """
         try:
             # for PATCH updates github requires the list_key (the
             # attribute name for identifying the object) to be set
@@ -494,16 +2556,21 @@ should be overwritten by child classes.
 
         url = self.url_template.format(**self._parameters)
         req = github_request("PATCH", url, data=data)
+        if "404 Not Found" in req.headers["status"]:
+            raise KeyError(self._parameters)
         if '200 OK' not in req.headers["status"]:
             raise ValueError("Couldn't update {} object: {}"
                              .format(self.__class__.__name__,
                                      req.json()["message"]))
+        return req.json()
 
+    def _updated(self, data):
         # update the cached data with the live data from
         # github. a detailed representation.
-        super(GhResource, self).update(req.json())
-
-        self.serialize()
+        super(GhResource, self).update(data)
+        self._is_partial = False
+        # the validators of the former representation are outdated
+        self._validators = (None, None)
 
 
 class GhCollection(GhBase):
@@ -567,6 +2634,9 @@ delete_url_template          -- for deleting resources
 
 Parameters:
 `**arguments` -- keyword filters passed through to github
+`local`       -- answer the filters from the local index of the cached
+                 resources instead (see local_search), only for
+                 collections of issues or pull requests
 
 Returns (<key>, GhResource()) tuples of the resources matching arguments.
         """
@@ -578,21 +2648,218 @@ Returns (<key>, GhResource()) tuples of the resources matching arguments.
                                                        self.child_parameter,
                                                        key)))
 
-        if len(arguments) > 0:
-            for x in self._get_resources(**arguments):
+        if arguments.pop("local", False):
+            for x in self._local_resources(arguments):
                 yield item(x[self.list_key], x)
+        elif len(arguments) > 0:
+            for x in self._search_resources(
+                    arguments, lambda data: item(data[self.list_key], data)):
+                yield x
         elif super(GhCollection, self).__len__() > 0 \
             and len([x for x in super(GhCollection, self).itervalues()
                      if x is None]) == 0:
             for x in super(GhCollection, self).iterkeys():
                 yield item(x)
         else:
-            keys_candidate = []
-            for x in self._get_resources(**arguments):
-                keys_candidate.append((x[self.list_key], 'partial'))
-                yield item(x[self.list_key], x)
-            super(GhCollection, self).update(keys_candidate)
-            self.serialize()
+            # another process refreshing the collection also stores
+            # the partial data of its items
+            leased = self.lease_refresh()
+            if leased is False and self.wait_for_refresh() \
+               and None not in super(GhCollection, self).itervalues():
+                for x in super(GhCollection, self).iterkeys():
+                    yield item(x)
+                return
+
+            try:
+                for x in self._refresh(item):
+                    yield x
+            finally:
+                if leased:
+                    self.release_lease()
+
+    # request only the resources updated since the last refresh, for
+    # collections whose github api supports the `since` parameter, set
+    # per class in config section "Incremental sync"
+    incremental_sync = False
+
+    def _incremental_sync(self):
+        return bool(int(class_option("Incremental sync", self.__class__,
+                                     self.incremental_sync)))
+
+    def _refresh(self, item):
+        """Generator over item(key, data) of all resources, which caches
+their keys once it has been iterated completely.
+
+With incremental_sync only the resources updated since the highest
+`updated_at` seen by the last refresh are requested and merged into
+the cached keys. github didn't change the others, so their cached data
+is confirmed and they are yielded as item(key) at the end. Deletions on
+github are noticed only by a full refresh, see resync.
+        """
+        base = self._sync_base()
+        if base is None:
+            (watermark, keys, arguments) = (None, [], dict())
+        else:
+            (watermark, keys) = base
+            arguments = dict(since=watermark)
+
+        changed = []
+        for x in self._get_resources(**arguments):
+            changed.append(x[self.list_key])
+            watermark = max(watermark, x.get("updated_at"))
+            yield item(x[self.list_key], x)
+
+        seen = set(changed)
+        unchanged = [key for key in keys if key not in seen]
+        if unchanged and not confirm_entities(
+                [self._child_url(key) for key in unchanged],
+                int(time.time()
+                    + int(class_option("Expiral time", self.child_class,
+                                       self.child_class.expiral_time)))):
+            # the data of some was dropped meanwhile
+            self._forget_watermark()
+        for key in unchanged:
+            yield item(key)
+
+        if base is None:
+            # the keys of a full refresh replace the cached ones
+            super(GhCollection, self).clear()
+        super(GhCollection, self).update((key, 'partial')
+                                         for key in changed + unchanged)
+        self.serialize()
+        self._store_watermark(watermark)
+
+    def _sync_base(self):
+        """Return (watermark, keys) of the last refresh, if it can be
+continued incrementally, or None.
+
+That requires the cached keys of the last refresh, even if they
+expired, and the cached data of all of them.
+        """
+        if not self._incremental_sync():
+            return None
+        row = self.sqlite.execute("select since from watermarks"
+                                  " where identifier=? and parameters=?",
+                                  (self.__class__.__name__,
+                                   self._cache_parameters())).fetchone()
+        if row is None or not self.deserialize(stale=True):
+            return None
+
+        keys = super(GhCollection, self).items()
+        if None in (value for key, value in keys):
+            return None
+        return (row[0], [key for key, value in keys])
+
+    def _child_url(self, key):
+        """Return the canonical api url of the resource `key` """
+        return URL_BASE + self.child_class.url_template.format(
+            **set_on_new_dict(self._parameters, self.child_parameter, key))
+
+    def _store_watermark(self, watermark):
+        """Continue the next refresh from `watermark`, with incremental_sync
+        """
+        if self._incremental_sync() and watermark is not None:
+            self.sqlite.execute("insert or replace into watermarks"
+                                " values (?,?,?)",
+                                (self.__class__.__name__,
+                                 self._cache_parameters(), watermark))
+
+    def _forget_watermark(self):
+        self.sqlite.execute("delete from watermarks"
+                            " where identifier=? and parameters=?",
+                            (self.__class__.__name__,
+                             self._cache_parameters()))
+
+    def resync(self):
+        """Drop the cached keys and the watermark of the incremental sync,
+so that the next access lists all resources from github again.
+        """
+        flush_unit_of_work()
+        self._forget_watermark()
+        self.sqlite.execute("delete from cache"
+                            " where identifier=? and parameters=?",
+                            (self.__class__.__name__,
+                             self._cache_parameters()))
+        memory_cache().discard(("cache", self.__class__.__name__,
+                                self._cache_parameters()))
+        super(GhCollection, self).clear()
+
+    # the collections of single issues or pull requests, which backfill
+    # fills from this collection of a repository: their class, the
+    # parameter identifying them and the field of a resource holding
+    # the url of its issue or pull request
+    backfill_class = None
+    backfill_parameter = None
+    backfill_url_field = None
+
+    def backfill(self, keys=None, since=None):
+        """Fill the cached collections of the issues or pull requests `keys`
+(default all) from the listing of this collection
+
+Lists the resources of the whole repository in a few pages, instead
+of a request per issue or pull request, and caches their keys as the
+collections of their issues or pull requests (see backfill_class).
+Given `keys`, whose collections are cached and haven't expired, are
+skipped. With `since` only the resources updated since then are
+listed, which extend the cached keys of the collections, so
+collections without cached keys are skipped.
+
+Issues and pull requests without resources aren't listed, so their
+collections aren't filled.
+
+Returns the keys of the filled collections.
+        """
+        def collection(key):
+            return self.backfill_class(
+                self._parent,
+                **set_on_new_dict(self._parameters,
+                                  self.backfill_parameter, key))
+
+        def cached(c):
+            return super(GhCollection, c).__len__() > 0 \
+                and None not in super(GhCollection, c).itervalues()
+
+        if keys is not None:
+            keys = set(str(key) for key in keys
+                       if not cached(collection(key)))
+            if not keys:
+                return []
+
+        buckets = dict()
+        arguments = dict(since=since) if since is not None else dict()
+        for key, resource in self.search(**arguments):
+            parent = str(resource[self.backfill_url_field]).rsplit("/", 1)[1]
+            if keys is None or parent in keys:
+                buckets.setdefault(parent, []).append((key, resource))
+
+        filled = []
+        with self.transaction():
+            for parent, resources in sorted(buckets.iteritems()):
+                c = collection(parent)
+                if since is None:
+                    super(GhCollection, c).clear()
+                elif not c.deserialize(stale=True) or not cached(c):
+                    continue
+                super(GhCollection, c).update((key, 'partial')
+                                              for key, resource in resources)
+                c.serialize()
+                if since is None:
+                    c._store_watermark(max(resource.get("updated_at")
+                                           for key, resource in resources))
+                filled.append(parent)
+        return filled
+
+    # number of search results buffered by asearch
+    asearch_depth = 100
+
+    def asearch(self, **arguments):
+        """Asynchronous search
+
+Returns an AsyncIterator over the (<key>, GhResource()) tuples of
+search(**arguments), which is run by a thread of its own. Thus many
+collections can be queried at the same time.
+        """
+        return AsyncIterator(self.search(**arguments), self.asearch_depth)
 
     def _get_resources(self, **arguments):
         """Query github for all or a subset of resources
@@ -600,19 +2867,192 @@ Returns (<key>, GhResource()) tuples of the resources matching arguments.
 Returns a generator to iterate over all matching github resources.
         """
         url = self.list_url_template.format(**self._parameters)
-        return github_request_paginated("GET", url, params=arguments)
+        return chain.from_iterable(
+            github_request_paginated("GET", url, params=params)
+            for params in self._list_queries(arguments))
+
+    def _list_queries(self, arguments):
+        """Return the list of parameters of the github requests, which
+together list the resources matching `arguments`.
+        """
+        return [arguments]
+
+    # seconds a count is cached, set per class in config section
+    # "Count expiral time"
+    count_expiral_time = 10*60
+
+    def count(self, **filters):
+        """Return the number of resources matching `filters`
+
+Asks github for a single resource per page, which reveals the number
+of pages in its rel="last" link, instead of listing the resources.
+Counts are cached for count_expiral_time seconds.
+        """
+        count = self._cached_query("count", filters)
+        if count is None:
+            url = self.list_url_template.format(**self._parameters)
+            count = sum(github_request_length(url, params)
+                        for params in self._list_queries(filters))
+            self._store_query("count", filters, count,
+                              class_option("Count expiral time",
+                                           self.__class__,
+                                           self.count_expiral_time))
+        return count
+
+    # seconds the results of a search with arguments are cached, set
+    # per class in config section "Search expiral time"
+    search_expiral_time = 5*60
+
+    def _search_resources(self, arguments, item):
+        """Generator over (<key>, GhResource()) tuples of the resources
+matching `arguments`, which are instantiated by item(data).
+
+Serves the cached result of an equivalent search or queries github
+and caches the result, once it has been iterated completely. The
+result refers to the resources in the entity store by their url, so it
+is only served while all of them are cached.
+
+Within the stale-while-revalidate window of the collection an expired
+result is served and the search is repeated in the background.
+        """
+        window = self._stale_window()
+        for stale in ((False, window) if window else (False,)):
+            urls = self._cached_query("search", arguments, stale)
+            if urls is None:
+                continue
+            entities = [load_entity(url, stale) for url in urls]
+            if None in entities:
+                continue
+
+            if stale:
+                revalidate_in_background(
+                    lambda: self._refresh_search(arguments, item))
+            for entity in entities:
+                yield item(entity[0])
+            return
+
+        for x in self._fetch_search(arguments, item):
+            yield x
+
+    def _refresh_search(self, arguments, item):
+        """Repeat the search of _search_resources to refresh its cached
+result, unless another thread or process is already doing so.
+        """
+        key = self._query_key("search", arguments)
+        if self.acquire_lease(*key):
+            try:
+                for x in self._fetch_search(arguments, item):
+                    pass
+            finally:
+                self.release_lease(*key)
+
+    def _fetch_search(self, arguments, item):
+        """Query github for the search of _search_resources """
+        urls = []
+        for x in self._get_resources(**arguments):
+            ret = item(x)
+            urls.append(ret[1]._entity_url())
+            yield ret
+        if None in urls:
+            # the results can't refer to resources without canonical url
+            return
+        self._store_query("search", arguments, urls,
+                          class_option("Search expiral time",
+                                       self.__class__,
+                                       self.search_expiral_time))
+
+    def _local_resources(self, arguments):
+        """Generator over the data of the resources matching `arguments`
+from the local index.
+        """
+        kind = self.child_class.index_kind
+        if kind is None:
+            raise ValueError("{} can't be searched locally"
+                             .format(self.__class__.__name__))
+        return local_search(kind,
+                            "{user}/{repo}".format(**self._parameters),
+                            arguments)
+
+    def _query_key(self, kind, arguments):
+        """Return (identifier, parameters) of the cache row of a query """
+        return (self.__class__.__name__ + "_" + kind,
+                "{}|{}".format(self._cache_parameters(),
+                               canonical_query(arguments)))
+
+    def _cached_query(self, kind, arguments, stale=False):
+        """Return the cached result of a `kind` query (count or search)
+with `arguments` or None.
+
+Expired results are only considered with `stale` (True or the number
+of seconds since they expired).
+        """
+        key = self._query_key(kind, arguments)
+        unit = current_unit_of_work()
+        if unit is not None and key in unit.rows:
+            (result, validators, expires) = unit.rows[key][0]
+            return result if expires >= expiry_cutoff(stale) else None
+
+        row = self.sqlite.execute(
+            'select data from cache where identifier=? and parameters=?'
+            ' and expires >= ?', key + (expiry_cutoff(stale),)).fetchone()
+        return None if row is None else serialization.decode(row[0])
+
+    def _store_query(self, kind, arguments, result, expiral_time):
+        key = self._query_key(kind, arguments)
+        expires = int(time.time() + int(expiral_time))
+        blob = serialization.encode(result)
+
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.put_row(key[0], key[1], (result, (None, None), expires),
+                         blob, False)
+            return
+
+        self.sqlite.execute("insert or replace into cache"
+                            " (identifier, parameters, expires, data,"
+                            "  version)"
+                            " values (?,?,?,?," + CACHE_VERSION + ")",
+                            key + (expires, buffer(blob)) + key)
+
+    def _forget_queries(self):
+        """Drop the cached counts and search results, after resources were
+added, changed or deleted.
+        """
+        identifiers = (self.__class__.__name__ + "_count",
+                       self.__class__.__name__ + "_search")
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.drop_rows(identifiers, self._cache_parameters() + "|")
+        self.sqlite.execute("delete from cache"
+                            " where identifier in (?,?) and parameters like ?",
+                            identifiers + (self._cache_parameters() + "|%",))
 
     def iterkeys(self):
         if super(GhCollection, self).__len__() > 0:
             for x in super(GhCollection, self).iterkeys():
                 yield x
+        elif self._incremental_sync():
+            # the incremental refresh relies on the cached data of all
+            # resources, which search stores
+            for key, resource in self.search():
+                yield key
         else:
-            keys_candidate = []
-            for x in self._get_resources():
-                keys_candidate.append((x[self.list_key], None))
-                yield x[self.list_key]
-            super(GhCollection, self).update(keys_candidate)
-            self.serialize()
+            leased = self.lease_refresh()
+            if leased is False and self.wait_for_refresh():
+                for x in super(GhCollection, self).iterkeys():
+                    yield x
+                return
+
+            try:
+                keys_candidate = []
+                for x in self._get_resources():
+                    keys_candidate.append((x[self.list_key], None))
+                    yield x[self.list_key]
+                super(GhCollection, self).update(keys_candidate)
+                self.serialize()
+            finally:
+                if leased:
+                    self.release_lease()
 
     __iter__ = iterkeys
 
@@ -632,7 +3072,9 @@ Returns a generator to iterate over all matching github resources.
         return list(self.iteritems())
 
     def __len__(self):
-        return len(self.keys())
+        if super(GhCollection, self).__len__() > 0:
+            return super(GhCollection, self).__len__()
+        return self.count()
 
     def __getitem__(self, key):
         """Return the GhResource object for `key` """
@@ -653,6 +3095,73 @@ Returns a generator to iterate over all matching github resources.
         self._debug("add", *("{}={}".format(k, v)
                              for k, v in arguments.iteritems()))
 
+        (key, data) = self._add_request(arguments)
+        self._added(key, data)
+        self.serialize()
+        self._forget_queries()
+        self.invalidate_dependents(
+            added=[(key, super(GhCollection, self).__getitem__(key))])
+
+        # return the new resource
+        if data is not None:
+            return self._child(key, data)
+
+    def add_many(self, arguments, concurrency=None):
+        """Create many new resources at once
+
+Sends the requests for the dictionaries of `arguments` with up to
+`concurrency` at the same time (default from batch_concurrency()) and
+stores the new resources in the cache at the end.
+
+Returns (results, errors), dictionaries by the position in
+`arguments` of the new resources (None for collections which add
+with PUT) and of the exceptions of failed requests.
+        """
+        self._debug("add_many", str(len(arguments)))
+
+        outcomes = run_batch(self._add_request, arguments, concurrency)
+        results = dict()
+        errors = dict()
+        added = []
+        with self.transaction():
+            for i, (ret, exc) in enumerate(outcomes):
+                if exc is not None:
+                    errors[i] = exc
+                    continue
+                (key, data) = ret
+                self._added(key, data)
+                results[i] = (self._child(key, data)
+                              if data is not None
+                              else None)
+                added.append(
+                    (key, super(GhCollection, self).__getitem__(key)))
+            self.serialize()
+            self._forget_queries()
+            if added:
+                self.invalidate_dependents(added=added)
+
+        return (results, errors)
+
+    def _child(self, key, data=None):
+        """Return the child resource `key`, with `data` if it is known """
+        parameters = set_on_new_dict(self._parameters,
+                                     self.child_parameter,
+                                     key)
+        return self.child_class(parent=self, data=data, **parameters)
+
+    def _added(self, key, data):
+        """Record the new resource `key` in the collection """
+        super(GhCollection, self).__setitem__(key,
+                                              'partial'
+                                              if data is not None
+                                              else None)
+
+    def _add_request(self, arguments):
+        """Send the request creating a resource from `arguments` to github
+
+Returns (key, data) of the new resource, data is None for collections
+which add with PUT, as github doesn't return any content then.
+        """
         # check if all required arguments are provided
         for required_arg in self.add_required_arguments:
             if required_arg not in arguments:
@@ -667,17 +3176,8 @@ Returns a generator to iterate over all matching github resources.
                 raise ValueError("Couldn't create {} object: {}"
                                  .format(self.child_class.__name__,
                                          req.json()["message"]))
-            else:
-                # return the new resource
-                data = req.json()
-                super(GhCollection, self).__setitem__(data[self.list_key],
-                                                      'partial')
-                self.serialize()
-
-                parameters = set_on_new_dict(self._parameters,
-                                             self.child_parameter,
-                                             data[self.list_key])
-                return self.child_class(parent=self, data=data, **parameters)
+            data = req.json()
+            return (data[self.list_key], data)
 
         elif self.add_method == "PUT":
             # For PUT requests the child_parameter is already part of
@@ -698,15 +3198,94 @@ Returns a generator to iterate over all matching github resources.
                                  .format(self.child_class.__name__,
                                          req.json()["message"]))
             # PUT requests don't return any content
+            return (arguments[self.list_key], None)
 
-            super(GhCollection, self).__setitem__(arguments[self.list_key],
-                                                  None)
-            self.serialize()
+        raise ValueError("Unknown add_method {}".format(self.add_method))
+
+    def update_many(self, patches, concurrency=None):
+        """Update many resources at once
+
+`patches` maps the keys of resources to the data to change. The
+requests are sent with up to `concurrency` at the same time (default
+from batch_concurrency()) and the cache is updated at the end.
+
+Returns (results, errors), dictionaries by key of the updated
+resources and of the exceptions of failed requests.
+        """
+        self._debug("update_many", str(len(patches)))
+
+        def patch(item):
+            (key, data) = item
+            # the PATCH only needs the url, the resource isn't fetched
+            try:
+                resource = self._child(key, CachedData(dict(), False))
+            except ValueError:
+                raise KeyError(key)
+            return (resource, resource._patch(data))
+
+        items = patches.items()
+        outcomes = run_batch(patch, items, concurrency)
+        results = dict()
+        errors = dict()
+        with self.transaction():
+            for (key, data), (ret, exc) in izip(items, outcomes):
+                if exc is not None:
+                    errors[key] = exc
+                    continue
+                (resource, data) = ret
+                resource._updated(data)
+                resource.serialize()
+                resource.invalidate_dependents()
+                results[key] = resource
+            if results:
+                self._forget_queries()
+
+        return (results, errors)
 
     def __delitem__(self, key):
         """Delete resource from collection """
         self._debug("__delitem__", key)
 
+        self._delete_request(key)
+        self._forget_queries()
+        self.invalidate_dependents(deleted=[key])
+
+        try:
+            super(GhCollection, self).__delitem__(key)
+            self.serialize()
+        except KeyError:
+            pass
+
+    def del_many(self, keys, concurrency=None):
+        """Delete many resources at once
+
+Sends the requests with up to `concurrency` at the same time (default
+from batch_concurrency()) and removes the deleted keys from the cached
+collection at the end.
+
+Returns (deleted, errors), the list of deleted keys and a dictionary
+by key of the exceptions of failed requests.
+        """
+        self._debug("del_many", str(len(keys)))
+
+        outcomes = run_batch(self._delete_request, keys, concurrency)
+        deleted = [key for key, (ret, exc) in izip(keys, outcomes)
+                   if exc is None]
+        errors = dict((key, exc) for key, (ret, exc) in izip(keys, outcomes)
+                      if exc is not None)
+
+        if deleted:
+            with self.transaction():
+                self._forget_queries()
+                self.invalidate_dependents(deleted=deleted)
+                for key in deleted:
+                    super(GhCollection, self).pop(key, None)
+                self.serialize()
+
+        return (deleted, errors)
+
+    def _delete_request(self, key):
+        """Send the request deleting resource `key` to github """
         tmpl_vars = set_on_new_dict(self._parameters,
                                     self.child_parameter, key)
         url = self.delete_url_template.format(**tmpl_vars)
@@ -716,12 +3295,6 @@ Returns a generator to iterate over all matching github resources.
                              .format(self.child_class.__name__,
                                      req.json()["message"]))
 
-        try:
-            super(GhCollection, self).__delitem__(key)
-            self.serialize()
-        except KeyError:
-            pass
-
 
 class cache(tpv.generic.cache):
     @aspect.plumb
@@ -737,6 +3310,29 @@ class cache(tpv.generic.cache):
 
         return ret
 
+    @aspect.plumb
+    def add_many(_next, self, arguments, concurrency=None):
+        (results, errors) = _next(arguments, concurrency)
+
+        if self.cache_keys is not None:
+            for i in sorted(results):
+                if self.add_method == "POST":
+                    self.cache_keys.append(results[i][self.list_key])
+                elif self.add_method == "PUT":
+                    self.cache_keys.append(arguments[i][self.list_key])
+
+        return (results, errors)
+
+    @aspect.plumb
+    def del_many(_next, self, keys, concurrency=None):
+        (deleted, errors) = _next(keys, concurrency)
+
+        if self.cache_keys is not None:
+            self.cache_keys[:] = [key for key in self.cache_keys
+                                  if key not in deleted]
+
+        return (deleted, errors)
+
     def _wrap_child(self, child):
         cls = child.__class__
         child = cache(cls, cache=self._get_cache(child))(
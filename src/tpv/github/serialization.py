@@ -0,0 +1,133 @@
+"""Encoding of the data kept in the cache db
+
+The data is stored as the JSON github sent it as, in a versioned
+envelope. The first byte of a blob is the FORMAT_VERSION, the second
+holds the flags of the payload:
+
+  COMPRESSED  the payload is compressed with zlib
+  LAZY        the payload is a JSON object split into the JSON of its
+              fields, see LazyMapping
+
+Unlike the pickles of older versions, the blobs can be decoded without
+running code from the cache db, so a cache db may be shared between
+machines. Older cache dbs are converted by migrate when they are
+opened.
+"""
+
+import json
+import pickle
+import zlib
+from collections import Mapping
+
+FORMAT_VERSION = 1
+
+# flags of the payload
+COMPRESSED = 1
+LAZY = 2
+
+# zlib level trading encoding time for size
+compression_level = 6
+
+_decode_json = json.JSONDecoder().decode
+
+
+class LazyMapping(Mapping):
+    """Read-only mapping of a JSON object, which decodes a field on its
+first access
+
+`values` holds the JSON of all fields, `index` the start and end of
+the JSON of each field in it.
+    """
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+        self._decoded = dict()
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            (start, end) = self._index[key]
+            value = self._decoded[key] = _decode_json(
+                self._values[start:end])
+            return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __repr__(self):
+        return "<LazyMapping of {}>".format(", ".join(sorted(self._index)))
+
+
+def dumps(data):
+    """Return the compact JSON of `data` encoded as utf-8 """
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if isinstance(raw, unicode):
+        raw = raw.encode("utf-8")
+    return raw
+
+
+def encode(data, compress=False, lazy=False):
+    """Return the blob of `data`, compressed if asked and it saves space
+
+With `lazy` a dictionary is decoded as a LazyMapping.
+    """
+    flags = 0
+    if lazy and isinstance(data, dict):
+        (values, index) = ([], dict())
+        offset = 0
+        for key, value in data.iteritems():
+            values.append(dumps(value))
+            index[key] = (offset, offset + len(values[-1]))
+            offset += len(values[-1])
+        # the JSON of the index doesn't contain newlines
+        raw = dumps(index) + "\n" + "".join(values)
+        flags |= LAZY
+    else:
+        raw = dumps(data)
+
+    if compress:
+        packed = zlib.compress(raw, compression_level)
+        if len(packed) < len(raw):
+            (raw, flags) = (packed, flags | COMPRESSED)
+    return chr(FORMAT_VERSION) + chr(flags) + raw
+
+
+def decode(blob):
+    """Return the data of a `blob` created by encode
+
+Raises ValueError, if the blob has an unknown format.
+    """
+    blob = str(blob)
+    if blob[:1] != chr(FORMAT_VERSION):
+        raise ValueError("Unknown format of cached data")
+
+    raw = blob[2:]
+    flags = ord(blob[1])
+    if flags & COMPRESSED:
+        raw = zlib.decompress(raw)
+    if flags & LAZY:
+        (index, values) = raw.split("\n", 1)
+        return LazyMapping(values, json.loads(index))
+    return json.loads(raw)
+
+
+def migrate(blob, compress=False):
+    """Return the blob of the protocol 0 pickle `blob` of older versions
+in the current format, or None if it already is.
+    """
+    blob = str(blob)
+    if blob[:1] == chr(FORMAT_VERSION):
+        return None
+    # protocol 0 pickles start with a printable opcode
+    return encode(pickle.loads(blob), compress)
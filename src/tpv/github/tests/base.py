@@ -6,13 +6,14 @@ from contextlib import contextmanager
 
 from .. import github_base
 from .. import github
+from .server import LocalGithub
 
 
 class MockRequest(object):
     def __init__(self, status, body, extra_headers=dict()):
         self.status = status
         self.extra_headers = extra_headers
-        self.body = json.loads(body)
+        self.body = json.loads(body) if body else None
 
     @property
     def headers(self):
@@ -28,7 +29,7 @@ class TestCase(unittest.TestCase):
         '''A context manager, which monkey patches github_request to mock
     github.
         '''
-        def intercept(method, urlpath, data=None, params=None):
+        def intercept(method, urlpath, data=None, params=None, headers=None):
             if params == dict():
                 params = None
 
@@ -41,9 +42,10 @@ class TestCase(unittest.TestCase):
             self.assertEqual(urlpath, request["urlpath"])
             self.assertEqual(data, request.get("data"))
             self.assertEqual(params, request.get("params"))
+            self.assertEqual(headers, request.get("headers"))
 
             return MockRequest(request.get("response_status", "200 OK"),
-                               request["response_body"],
+                               request.get("response_body"),
                                request.get("response_extra_headers", dict()))
 
         prev_request = github_base.github_request
@@ -70,3 +72,24 @@ class TestCase(unittest.TestCase):
     #         return self.answers[(method, urlpath)]
 
     #     github.github_request = intercept
+
+
+class ServerTestCase(TestCase):
+    """TestCase sending the requests to a LocalGithub started by serve """
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+
+        self.prev_config = github_base.config
+        self.prev_url_base = github_base.URL_BASE
+        github_base.config = {"github.user": "octocat",
+                              "github.token": "secret"}
+
+    def tearDown(self):
+        github_base.config = self.prev_config
+        github_base.URL_BASE = self.prev_url_base
+
+    def serve(self, routes):
+        server = LocalGithub(routes)
+        github_base.URL_BASE = server.url
+        return server
@@ -0,0 +1,76 @@
+"""Compare the cache formats on the github payloads used by the tests
+
+Reports the bytes per entry, the decode time per entry and the time
+to decode an entry and read the fields the cli lists issues with, of
+the protocol 0 pickles of older versions and the current format of
+the serialization module, plain, compressed and lazy. Run with
+
+  python -m tpv.github.tests.benchmark_serialization
+"""
+from __future__ import absolute_import
+
+import ast
+import glob
+import json
+import os
+import pickle
+import timeit
+
+from .. import serialization
+
+
+def test_payloads():
+    """Return the resources of the response bodies in the test modules """
+    payloads = []
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(__file__),
+                                                  "test_github*.py"))):
+        with open(filename) as f:
+            tree = ast.parse(f.read(), filename)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.keyword) \
+               and node.arg == "response_body" \
+               and isinstance(node.value, ast.Str):
+                try:
+                    body = json.loads(node.value.s)
+                except ValueError:
+                    continue
+                payloads.extend(body if isinstance(body, list) else [body])
+    return [x for x in payloads if isinstance(x, dict)]
+
+
+formats = [
+    ("pickle (protocol 0)", pickle.dumps, pickle.loads),
+    ("json", serialization.encode, serialization.decode),
+    ("json+zlib", lambda data: serialization.encode(data, True),
+     serialization.decode),
+    ("json lazy", lambda data: serialization.encode(data, lazy=True),
+     serialization.decode)]
+
+# the fields of an issue listed by the cli
+listed_fields = ("number", "title", "assignee")
+
+
+def read_listed(data):
+    return [data.get(x) for x in listed_fields]
+
+
+def run(payloads, number=200):
+    print "{} payloads".format(len(payloads))
+    print "{:<20} {:>12} {:>16} {:>16}".format("format", "bytes/entry",
+                                               "decode us/entry",
+                                               "listing us/entry")
+    for name, encode, decode in formats:
+        blobs = [encode(x) for x in payloads]
+        decoding = timeit.timeit(lambda: [decode(x) for x in blobs],
+                                 number=number)
+        listing = timeit.timeit(
+            lambda: [read_listed(decode(x)) for x in blobs], number=number)
+        print "{:<20} {:>12.1f} {:>16.2f} {:>16.2f}".format(
+            name,
+            float(sum(len(x) for x in blobs)) / len(blobs),
+            decoding / number / len(blobs) * 1e6,
+            listing / number / len(blobs) * 1e6)
+
+
+if __name__ == "__main__":
+    run(test_payloads())
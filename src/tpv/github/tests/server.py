@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+
+import json
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse
+
+
+# reasons of statuses sent by github which BaseHTTPRequestHandler doesn't know
+reasons = {422: "Unprocessable Entity"}
+
+
+class LocalGithub(ThreadingMixIn, HTTPServer):
+    """A stand-in for the github api listening on localhost
+
+`routes` maps (method, path with query) to a (status, headers, body)
+tuple or to a callable returning such a tuple for the request handler
+(with the request body as attribute `body`); all received requests are
+recorded in `received`.
+
+Usage:
+
+with LocalGithub({("GET", "/user"): (200, {}, '{"login": "octocat"}')}) \\
+        as server:
+    requests.get(server.url + "/user")
+    """
+
+    daemon_threads = True
+
+    def __init__(self, routes):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), LocalGithubHandler)
+        self.routes = routes
+        self.received = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class LocalGithubHandler(BaseHTTPRequestHandler):
+    # keep-alive connections, as github does
+    protocol_version = "HTTP/1.1"
+
+    def handle_request(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.body = self.rfile.read(length) if length else None
+
+        with server.lock:
+            server.received.append((self.command, self.path,
+                                    dict(self.headers), body))
+
+        route = server.routes.get((self.command, self.path))
+        if route is None:
+            route = server.routes.get((self.command,
+                                       urlparse(self.path).path))
+        if route is None:
+            route = (404, {}, json.dumps(dict(message="Not Found")))
+        elif callable(route):
+            route = route(self)
+
+        status, headers, response = route
+        reason = self.responses.get(status, (reasons.get(status, ""),))[0]
+        self.send_response(status, reason)
+        # github sends the status line also as header
+        self.send_header("Status", "{} {}".format(status, reason))
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
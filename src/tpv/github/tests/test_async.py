@@ -0,0 +1,159 @@
+from __future__ import absolute_import
+
+import json
+import time
+
+from .base import ServerTestCase
+from .. import github_base
+from ..github import Github, GhRepo, GhRepoIssues, GhIssue
+
+
+def counted(name):
+    """Route answering with the number of the request as version """
+    versions = []
+
+    def route(handler):
+        versions.append(1)
+        return (200, {}, json.dumps(dict(name=name, version=len(versions))))
+    return route
+
+
+def slow(status, body, delay=0.2):
+    """Route answering after `delay` seconds """
+    def route(handler):
+        time.sleep(delay)
+        return (status, {}, body)
+    return route
+
+
+class TestAsync(ServerTestCase):
+    def test_aget_concurrent(self):
+        names = ["Hello-{}".format(i) for i in range(5)]
+        routes = dict((("GET", "/repos/octocat/" + name),
+                       slow(200, json.dumps(dict(name=name))))
+                      for name in names)
+
+        with self.serve(routes):
+            repos = Github()["repos"]["octocat"]
+
+            start = time.time()
+            results = [repos.aget(name) for name in names]
+            got = [x.get(5) for x in results]
+
+            # the five slow requests overlap
+            self.assertTrue(time.time() - start < 0.2 * len(names))
+
+        self.assertTrue(all(isinstance(x, GhRepo) for x in got))
+        self.assertEqual([x["name"] for x in got], names)
+
+    def test_aget_lease(self):
+        with self.serve({("GET", "/repos/octocat/Hello-World"):
+                         slow(200, '{ "name": "Hello-World" }')}) as server:
+            repos = Github()["repos"]["octocat"]
+
+            results = [repos.aget("Hello-World") for i in range(5)]
+            self.assertEqual([x.get(5)["name"] for x in results],
+                             ["Hello-World"] * 5)
+
+        # one thread got the lease, the others waited for its row
+        self.assertEqual(len(server.received), 1)
+
+    def test_request_coalesced(self):
+        with self.serve({("GET", "/user"):
+                         slow(200, '{ "login": "octocat" }')}) as server:
+            saved = github_base.single_flight.saved
+
+            results = [github_base.async_pool().apply_async(
+                github_base.github_request, ("GET", "/user"))
+                for i in range(5)]
+            self.assertEqual([x.get(5).json()["login"] for x in results],
+                             ["octocat"] * 5)
+
+        # the concurrent GET requests shared one response
+        self.assertEqual(len(server.received), 1)
+        self.assertEqual(github_base.single_flight.saved - saved, 4)
+
+    def test_aget_missing(self):
+        with self.serve({}):
+            repos = Github()["repos"]["octocat"]
+            self.assertRaises(KeyError, repos.aget("Hello-World").get, 5)
+
+    def test_asearch_aupdate(self):
+        with self.serve({
+                ("GET", "/repos/octocat/Hello-World"):
+                (200, {}, '{ "name": "Hello-World" }'),
+                ("GET", "/repos/octocat/Hello-World/issues?state=open"):
+                (200, {}, '[ { "number": 1, "title": "Old" },'
+                          '  { "number": 2, "title": "Other" } ]'),
+                ("PATCH", "/repos/octocat/Hello-World/issues/1"):
+                (200, {}, '{ "number": 1, "title": "New" }')}) as server:
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+
+            issues = repo.aget("issues").get(5)
+            self.assertTrue(isinstance(issues, GhRepoIssues))
+
+            found = list(issues.asearch(state="open"))
+            self.assertEqual([no for no, issue in found], [1, 2])
+            self.assertTrue(isinstance(found[0][1], GhIssue))
+
+            issue = found[0][1]
+            issue.aupdate({"title": "New"}).get(5)
+            self.assertEqual(issue["title"], "New")
+
+            (method, path, headers, body) = server.received[-1]
+            self.assertEqual(method, "PATCH")
+            self.assertEqual(json.loads(body), dict(number=1, title="New"))
+
+    def test_stale_while_revalidate(self):
+        github_base.config["Stale while revalidate"] = {"GhRepo": "60"}
+        with self.serve({("GET", "/repos/octocat/Hello-World"):
+                         counted("Hello-World")}) as server:
+            repos = Github()["repos"]["octocat"]
+            self.assertEqual(repos["Hello-World"]["version"], 1)
+
+            github_base.GhBase.sqlite.execute(
+                "update entities set complete_expires = ?,"
+                " partial_expires = ?", (int(time.time()) - 10,) * 2)
+
+            # the expired data is served and refreshed in the background
+            self.assertEqual(repos["Hello-World"]["version"], 1)
+            github_base.wait_for_revalidations(5)
+            self.assertEqual(len(server.received), 2)
+            self.assertEqual(repos["Hello-World"]["version"], 2)
+            self.assertEqual(len(server.received), 2)
+
+            # beyond the window the refresh is awaited
+            github_base.GhBase.sqlite.execute(
+                "update entities set complete_expires = ?,"
+                " partial_expires = ?", (int(time.time()) - 120,) * 2)
+            self.assertEqual(repos["Hello-World"]["version"], 3)
+
+    def test_stale_search_lease(self):
+        github_base.config["Stale while revalidate"] = {"GhRepoIssues": "60"}
+        with self.serve({
+                ("GET", "/repos/octocat/Hello-World"):
+                (200, {}, '{ "name": "Hello-World" }'),
+                ("GET", "/repos/octocat/Hello-World/issues?state=open"):
+                (200, {}, '[ { "number": 1, "title": "Old" } ]')}) as server:
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            self.assertEqual([no for no, issue in
+                              issues.search(state="open")], [1])
+
+            github_base.GhBase.sqlite.execute(
+                "update cache set expires = ? where identifier = ?",
+                (int(time.time()) - 10, "GhRepoIssues_search"))
+            # another process is already repeating the search
+            (identifier, parameters) = issues._query_key(
+                "search", dict(state="open"))
+            github_base.GhBase.sqlite.execute(
+                "insert into leases values (?,?,?,?)",
+                (identifier, parameters, "other", time.time() + 30))
+
+            # the expired result is served without searching again
+            self.assertEqual([no for no, issue in
+                              issues.search(state="open")], [1])
+            github_base.wait_for_revalidations(5)
+            received = [path for (method, path, headers, body)
+                        in server.received]
+            self.assertEqual(received.count(
+                "/repos/octocat/Hello-World/issues?state=open"), 1)
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+import json
+import threading
+import time
+
+from .base import ServerTestCase
+from ..github import Github, GhIssue
+
+
+def created_issue(numbers):
+    """Route creating an issue with the next of `numbers`, if it has a
+title.
+    """
+    lock = threading.Lock()
+
+    def route(handler):
+        time.sleep(0.1)
+        issue = json.loads(handler.body)
+        if "title" not in issue:
+            return (422, {}, '{ "message": "Validation Failed" }')
+        with lock:
+            issue["number"] = numbers.pop(0)
+        return (201, {}, json.dumps(issue))
+    return route
+
+
+def patched_issue():
+    """Route answering a PATCH with the patched fields """
+    def route(handler):
+        time.sleep(0.1)
+        issue = json.loads(handler.body)
+        return (200, {}, json.dumps(issue))
+    return route
+
+
+class TestBatch(ServerTestCase):
+    def repo(self):
+        return Github()["repos"]["octocat"]["Hello-World"]
+
+    def test_add_update_many(self):
+        with self.serve({
+                ("GET", "/repos/octocat/Hello-World"):
+                (200, {}, '{ "name": "Hello-World" }'),
+                ("POST", "/repos/octocat/Hello-World/issues"):
+                created_issue([1, 2, 3, 4]),
+                ("PATCH", "/repos/octocat/Hello-World/issues/1"):
+                patched_issue(),
+                ("PATCH", "/repos/octocat/Hello-World/issues/2"):
+                patched_issue()}) as server:
+            issues = self.repo()["issues"]
+
+            start = time.time()
+            (results, errors) = issues.add_many(
+                [dict(title="Issue {}".format(i)) for i in range(4)]
+                + [dict(body="no title")])
+            # the slow requests overlapped
+            self.assertTrue(time.time() - start < 0.4)
+
+            self.assertEqual(sorted(results), [0, 1, 2, 3])
+            self.assertTrue(all(isinstance(x, GhIssue)
+                                for x in results.values()))
+            self.assertEqual(sorted(x["number"] for x in results.values()),
+                             [1, 2, 3, 4])
+            self.assertEqual(errors.keys(), [4])
+            self.assertTrue(isinstance(errors[4], ValueError))
+
+            # the new issues are known to the collection and cached
+            (results, errors) = issues.update_many({1: dict(title="One"),
+                                                    2: dict(title="Two"),
+                                                    5: dict(title="Five")})
+            self.assertEqual(results[1]["title"], "One")
+            self.assertEqual(results[2]["title"], "Two")
+            self.assertEqual(errors.keys(), [5])
+            self.assertTrue(isinstance(errors[5], KeyError))
+
+            received = [(method, path)
+                        for (method, path, headers, body) in server.received]
+            self.assertEqual(received.count(("POST",
+                                             "/repos/octocat/Hello-World"
+                                             "/issues")), 5)
+            self.assertEqual(received.count(("GET",
+                                             "/repos/octocat/Hello-World"
+                                             "/issues/1")), 0)
+            # unknown issues aren't fetched before they are patched
+            self.assertEqual(received.count(("GET",
+                                             "/repos/octocat/Hello-World"
+                                             "/issues/5")), 0)
+            self.assertEqual(received.count(("PATCH",
+                                             "/repos/octocat/Hello-World"
+                                             "/issues/5")), 1)
+
+        self.assertEqual(self.repo()["issues"][1]["title"], "One")
+
+    def test_del_many(self):
+        with self.serve({
+                ("GET", "/repos/octocat/Hello-World"):
+                (200, {}, '{ "name": "Hello-World" }'),
+                ("DELETE", "/repos/octocat/Hello-World/issues/comments/10"):
+                (204, {}, ''),
+                ("DELETE", "/repos/octocat/Hello-World/issues/comments/11"):
+                (204, {}, '')}):
+            comments = self.repo()["comments"]
+
+            (deleted, errors) = comments.del_many([10, 11, 12])
+            self.assertEqual(deleted, [10, 11])
+            self.assertEqual(errors.keys(), [12])
+            self.assertTrue(isinstance(errors[12], ValueError))
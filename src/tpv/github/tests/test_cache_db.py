@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+import multiprocessing
+import os
+import threading
+import time
+
+from .base import TestCase
+from .. import github_base
+from ..github import Github
+from ..github_base import GhBase
+
+
+def hammer(worker, rounds):
+    """Write and read the entities of `worker` and those of the others
+
+Runs in a process forked after the test opened its connection.
+    """
+    expires = int(time.time() + 60)
+    for i in range(rounds):
+        url = "https://api.github.com/stress/{}/{}".format(worker, i)
+        with GhBase.transaction():
+            github_base.store_entity(url, dict(worker=worker, i=i),
+                                     True, expires)
+            GhBase.sqlite.execute("insert or replace into maintenance"
+                                  " values (?,?)", ("stress", i))
+        github_base.memory_cache().clear()
+        assert github_base.load_entity(url)[0]["i"] == i
+        GhBase.sqlite.execute("select count(*) from entities").fetchone()
+        if i % 50 == 0:
+            github_base.collect_garbage()
+
+
+class TestCacheDB(TestCase):
+    def test_journal_mode(self):
+        self.assertEqual(GhBase.sqlite.execute("pragma journal_mode")
+                         .fetchone()[0], "wal")
+
+    def test_connections(self):
+        # every thread and every forked process connects on its own
+        connections = []
+        thread = threading.Thread(
+            target=lambda: connections.append(GhBase.sqlite))
+        thread.start()
+        thread.join()
+        self.assertFalse(connections[0] is GhBase.sqlite)
+
+        connection = GhBase.sqlite
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if GhBase.sqlite is not connection else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+    def test_multiprocess_stress(self):
+        (workers, rounds) = (4, 200)
+        processes = [multiprocessing.Process(target=hammer,
+                                             args=(worker, rounds))
+                     for worker in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        # none of them failed with "database is locked"
+        self.assertEqual([process.exitcode for process in processes],
+                         [0] * workers)
+        self.assertEqual(GhBase.sqlite.execute("select count(*) from entities"
+                                               " where url like '%/stress/%'")
+                         .fetchone()[0], workers * rounds)
+
+    def test_unit_of_work(self):
+        def rows(table):
+            return GhBase.sqlite.execute("select count(*) from {}"
+                                         .format(table)).fetchone()[0]
+
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/users/octocat/repos",
+                     response_body='[ { "name": "Hello-World" },'
+                                   '  { "name": "Hello-Earth" } ]')]):
+            with github_base.unit_of_work():
+                repos = Github()["repos"]["octocat"]
+                repos["Hello-World"]
+                self.assertEqual(sorted(name for name, repo
+                                        in repos.search()),
+                                 ["Hello-Earth", "Hello-World"])
+                # the first fetches took no leases, nothing was written
+                self.assertEqual(rows("entities"), 0)
+                self.assertEqual(rows("leases"), 0)
+
+                github_base.store_entity(
+                    "https://api.github.com/deferred", dict(name="Foo"),
+                    True, int(time.time() + 60))
+                self.assertEqual(rows("entities"), 0)
+                # the thread reads its deferred writes
+                self.assertEqual(github_base.load_entity(
+                    "https://api.github.com/deferred")[0]["name"], "Foo")
+            self.assertEqual(rows("entities"), 3)
+
+    def test_unit_of_work_index(self):
+        def rows(table):
+            return GhBase.sqlite.execute("select count(*) from {}"
+                                         .format(table)).fetchone()[0]
+
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="open"),
+                     response_body='[ { "number": 1, "state": "open",'
+                                   '    "labels": [ { "name": "bug" } ] },'
+                                   '  { "number": 2, "state": "open" } ]')]):
+            with github_base.unit_of_work():
+                issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+                self.assertEqual([no for no, issue
+                                  in issues.search(state="open")], [1, 2])
+                # the index and the search result wait for the flush
+                self.assertEqual(rows("items"), 0)
+                self.assertEqual(rows("cache where identifier like"
+                                      " '%_search'"), 0)
+                # and are seen by the thread
+                self.assertEqual([no for no, issue
+                                  in issues.search(state="open")], [1, 2])
+            self.assertEqual(rows("items"), 2)
+            self.assertEqual(rows("item_labels"), 1)
+            self.assertEqual(rows("cache where identifier like '%_search'"),
+                             1)
@@ -1,7 +1,13 @@
 from __future__ import absolute_import
 
-from .base import TestCase
+import pickle
+import threading
+import time
+
+from .base import TestCase, MockRequest
+from .. import github_base, serialization
 from ..github import Github, github_request_paginated, GhUsers
+from ..github_base import GhBase
 
 
 class TestGithub(TestCase):
@@ -28,3 +34,172 @@ class TestGithub(TestCase):
             repos = github_request_paginated("GET",
                                              "/user/repos?per_page=2")
             self.assertTrue(len(list(repos)) == 3)
+
+    def test_github_request_paginated_fanout(self):
+        link = ('<https://api.github.com/user/repos?page={}>; rel="next", '
+                '<https://api.github.com/user/repos?page=4>; rel="last"')
+        pages = {
+            "/user/repos": ('[ {"name": "a"} ]', link.format(2)),
+            "/user/repos?page=2": ('[ {"name": "b"} ]', link.format(3)),
+            "/user/repos?page=3": ('[ {"name": "c"} ]', link.format(4)),
+            "/user/repos?page=4": ('[ {"name": "d"} ]', None)
+        }
+        requested = []
+        running = [0, 0]
+        lock = threading.Lock()
+
+        def intercept(method, urlpath, data=None, params=None, headers=None):
+            with lock:
+                requested.append(urlpath)
+                running[0] += 1
+                running[1] = max(running)
+            # page 2 answers slowest, its items must still come first
+            time.sleep(0.05 if urlpath == "/user/repos?page=2" else 0.01)
+            with lock:
+                running[0] -= 1
+            body, link = pages[urlpath]
+            return MockRequest("200 OK", body,
+                               dict(Link=link) if link else dict())
+
+        prev_request = github_base.github_request
+        github_base.github_request = intercept
+        try:
+            names = [x["name"] for x in
+                     github_request_paginated("GET", "/user/repos",
+                                              concurrency=3)]
+        finally:
+            github_base.github_request = prev_request
+
+        self.assertEqual(names, ["a", "b", "c", "d"])
+        self.assertEqual(sorted(requested), sorted(pages))
+        self.assertTrue(running[1] > 1)
+
+    def test_github_request_paginated_prefetch(self):
+        requested = []
+
+        def intercept(method, urlpath, data=None, params=None, headers=None):
+            requested.append(urlpath)
+            page = int(urlpath.split("=")[1]) if "=" in urlpath else 1
+            return MockRequest(
+                "200 OK", '[ {{"page": {}}} ]'.format(page),
+                dict(Link='<https://api.github.com/user/repos?page={}>;'
+                          ' rel="next"'.format(page + 1)))
+
+        prev_request = github_base.github_request
+        github_base.github_request = intercept
+        try:
+            pages = github_request_paginated("GET", "/user/repos",
+                                             prefetch=1)
+            self.assertEqual(next(pages), dict(page=1))
+
+            # the next page is fetched while the first one is consumed
+            time.sleep(0.1)
+            self.assertTrue("/user/repos?page=2" in requested)
+
+            # stopping early cancels the fetches beyond the prefetch
+            # window
+            pages.close()
+            time.sleep(0.3)
+        finally:
+            github_base.github_request = prev_request
+
+        self.assertTrue("/user/repos?page=4" not in requested)
+
+
+class TestConditionalRequests(TestCase):
+    def expire_cache(self):
+        GhBase.sqlite.execute("update cache set expires = 0")
+        GhBase.sqlite.execute("update entities"
+                              " set complete_expires = 1, partial_expires = 1"
+                              " where complete_expires > 0")
+
+    def test_resource_revalidation(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_extra_headers=dict(ETag='"abc"'),
+                     response_body='{ "name": "Hello-World" }')]):
+            Github()["repos"]["octocat"]["Hello-World"]
+
+        self.expire_cache()
+
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     headers={"If-None-Match": '"abc"'},
+                     response_status="304 Not Modified")]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["name"], "Hello-World")
+
+        # the revalidated row is fresh again
+        with self.request_override([]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["name"], "Hello-World")
+
+    def test_page_revalidation(self):
+        with self.request_override([
+                dict(urlpath="/user/repos",
+                     response_extra_headers=dict(
+                         ETag='"p1"',
+                         Link='<https://api.github.com/user/repos?page=2>; rel="next"'),
+                     response_body='[ {"name": "Hello-World"} ]'),
+                dict(urlpath="/user/repos?page=2",
+                     response_extra_headers=dict(ETag='"p2"'),
+                     response_body='[ {"name": "Hello-Moon"} ]')]):
+            self.assertEqual(len(list(github_request_paginated(
+                "GET", "/user/repos"))), 2)
+
+        with self.request_override([
+                dict(urlpath="/user/repos",
+                     headers={"If-None-Match": '"p1"'},
+                     response_status="304 Not Modified",
+                     response_extra_headers=dict(
+                         Link='<https://api.github.com/user/repos?page=2>; rel="next"')),
+                dict(urlpath="/user/repos?page=2",
+                     headers={"If-None-Match": '"p2"'},
+                     response_extra_headers=dict(ETag='"p2b"'),
+                     response_body='[ {"name": "Hello-Mars"} ]')]):
+            self.assertEqual(
+                [x["name"] for x in github_request_paginated("GET",
+                                                             "/user/repos")],
+                ["Hello-World", "Hello-Mars"])
+
+        # the Link of a 304 reveals pages added after the cached ones, a
+        # 304 without it doesn't validate the pages after the page
+        with self.request_override([
+                dict(urlpath="/user/repos",
+                     headers={"If-None-Match": '"p1"'},
+                     response_status="304 Not Modified"),
+                dict(urlpath="/user/repos",
+                     response_extra_headers=dict(
+                         ETag='"p1"',
+                         Link='<https://api.github.com/user/repos?page=2>; rel="next"'),
+                     response_body='[ {"name": "Hello-World"} ]'),
+                dict(urlpath="/user/repos?page=2",
+                     headers={"If-None-Match": '"p2b"'},
+                     response_status="304 Not Modified",
+                     response_extra_headers=dict(
+                         Link='<https://api.github.com/user/repos?page=3>; rel="next"')),
+                dict(urlpath="/user/repos?page=3",
+                     response_body='[ {"name": "Hello-Venus"} ]')]):
+            self.assertEqual(
+                [x["name"] for x in github_request_paginated(
+                    "GET", "/user/repos", concurrency=1, prefetch=0)],
+                ["Hello-World", "Hello-Mars", "Hello-Venus"])
+
+    def test_migrate_cache_format(self):
+        # a resource cached by an older version
+        url = github_base.URL_BASE + "/repos/octocat/Hello-World"
+        GhBase.sqlite.execute("insert into entities (url, data,"
+                              " complete_expires, partial_expires, etag,"
+                              " last_modified) values (?,?,?,?,?,?)",
+                              (url, buffer(pickle.dumps({"name":
+                                                         "Hello-World"})),
+                               int(time.time()) + 60, int(time.time()) + 60,
+                               None, None))
+        GhBase.sqlite.execute("pragma user_version = 0")
+        GhBase.create_tables()
+
+        self.assertEqual(GhBase.sqlite.execute("pragma user_version")
+                         .fetchone()[0], serialization.FORMAT_VERSION)
+        with self.request_override([]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["name"], "Hello-World")
@@ -3,6 +3,8 @@ from __future__ import absolute_import
 import itertools
 
 from .base import TestCase
+from .. import github_base, serialization
+from ..github_base import GhBase
 from ..github import Github, GhRepoIssues, GhIssue, GhIssueComments, GhComment
 
 
@@ -12,6 +14,15 @@ class TestGithubIssues(TestCase):
         with self.request_override([
                 dict(urlpath="/repos/octocat/Hello-World",
                      response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(per_page=1),
+                     response_extra_headers=dict(
+                         Link='<https://api.github.com/repositories/1/issues?per_page=1&page=2>; rel="next", '
+                              '<https://api.github.com/repositories/1/issues?per_page=1&page=3>; rel="last"'),
+                     response_body='[ { "number": 1, "state": "open"} ]'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(per_page=1, state="closed"),
+                     response_body='[ { "number": 2, "state": "closed" } ]'),
                 dict(urlpath="/repos/octocat/Hello-World/issues",
                      response_body='[ { "number": 1, "state": "open"} ]'),
                 dict(urlpath="/repos/octocat/Hello-World/issues",
@@ -23,15 +34,15 @@ class TestGithubIssues(TestCase):
             self.assertEqual(issues._user, "octocat")
             self.assertEqual(issues._repo, "Hello-World")
 
-            self.assertTrue(len(issues) == 2)
+            # counted from the rel="last" links: 3 open, 1 closed
+            self.assertEqual(len(issues), 4)
+            self.assertEqual(issues.count(), 4)
             self.assertEqual(issues.keys(), [1, 2])
+            # the listed keys are counted locally
+            self.assertEqual(len(issues), 2)
 
+        # the data of the listed issues is cached along with the keys
         with self.request_override([
-                dict(urlpath="/repos/octocat/Hello-World/issues",
-                     response_body='[ { "number": 1, "state": "open"} ]'),
-                dict(urlpath="/repos/octocat/Hello-World/issues",
-                     params=dict(state="closed"),
-                     response_body='[ { "number": 2, "state": "closed" } ]'),
                 dict(urlpath="/repos/octocat/Hello-World/issues",
                      params=dict(state="closed"),
                      response_body='[ { "number": 2, "state": "closed" } ]')]):
@@ -42,6 +53,208 @@ class TestGithubIssues(TestCase):
                 list(x for x, y in issues.search(state="closed"))
             )
 
+    def test_incremental_sync(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     response_body='[ { "number": 1, "title": "Foo",'
+                                   '    "updated_at": "2014-01-01T00:00:00Z" } ]'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="closed"),
+                     response_body='[ { "number": 2, "title": "Bar",'
+                                   '    "updated_at": "2014-01-02T00:00:00Z" } ]')]):
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            self.assertEqual(sorted(issues.keys()), [1, 2])
+
+        GhBase.sqlite.execute("update cache set expires = 0")
+        GhBase.sqlite.execute("update entities"
+                              " set complete_expires = 1, partial_expires = 1"
+                              " where url like '%/issues/%'")
+        github_base.memory_cache().clear()
+
+        # only the issues updated since the last refresh are requested
+        since = "2014-01-02T00:00:00Z"
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(since=since),
+                     response_body='[ { "number": 3, "title": "New",'
+                                   '    "updated_at": "2014-01-03T00:00:00Z" } ]'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(since=since, state="closed"),
+                     response_body='[ { "number": 1, "title": "Closed",'
+                                   '    "updated_at": "2014-01-04T00:00:00Z" } ]')]):
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            self.assertEqual(sorted((no, issue["title"])
+                                    for no, issue in issues.search()),
+                             [(1, "Closed"), (2, "Bar"), (3, "New")])
+
+        self.assertEqual(GhBase.sqlite.execute("select since from watermarks")
+                         .fetchall(), [("2014-01-04T00:00:00Z",)])
+
+        # resync lists all issues again
+        issues.resync()
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     response_body='[ { "number": 3, "title": "New",'
+                                   '    "updated_at": "2014-01-03T00:00:00Z" } ]'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="closed"),
+                     response_body='[]')]):
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            self.assertEqual(issues.keys(), [3])
+
+    def test_issues_search_cache(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="open", labels="bug,ui"),
+                     response_body='[ { "number": 1, "state": "open" } ]'),
+                dict(method="POST",
+                     urlpath="/repos/octocat/Hello-World/issues",
+                     data=dict(title="New issue"),
+                     response_status="201 Created",
+                     response_body='{ "number": 2, "state": "open" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="open", labels="ui, bug"),
+                     response_body='[ { "number": 1, "state": "open" },'
+                                   '  { "number": 2, "state": "open" } ]')]):
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+
+            self.assertEqual([no for no, issue in
+                              issues.search(state="open", labels="bug,ui")],
+                             [1])
+
+            # an equivalent search is served from the cache
+            found = list(issues.search(labels="ui, bug", state="open"))
+            self.assertEqual([no for no, issue in found], [1])
+            self.assertTrue(isinstance(found[0][1], GhIssue))
+            self.assertEqual(found[0][1]["state"], "open")
+
+            # adding an issue invalidates the cached results
+            issues.add(title="New issue")
+            self.assertEqual([no for no, issue in
+                              issues.search(labels="ui, bug", state="open")],
+                             [1, 2])
+
+    def test_issues_local_search(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="open"),
+                     response_body='''
+                     [ { "number": 1, "state": "open",
+                         "user": { "login": "octocat" },
+                         "assignee": null, "milestone": null,
+                         "labels": [ { "name": "bug" } ],
+                         "created_at": "2014-01-01T00:00:00Z",
+                         "updated_at": "2014-03-01T00:00:00Z",
+                         "comments": 2 },
+                       { "number": 2, "state": "open",
+                         "user": { "login": "hubot" },
+                         "assignee": { "login": "octocat" },
+                         "milestone": { "number": 1 },
+                         "labels": [ { "name": "bug" }, { "name": "ui" } ],
+                         "created_at": "2014-02-01T00:00:00Z",
+                         "updated_at": "2014-02-15T00:00:00Z",
+                         "comments": 0 } ]''')]):
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            list(issues.search(state="open"))
+
+            # the listed issues are answered from the local index
+            def local(**filters):
+                return [no for no, issue in issues.search(local=True,
+                                                          **filters)]
+
+            self.assertEqual(local(), [2, 1])
+            self.assertEqual(local(labels="ui,bug"), [2])
+            self.assertEqual(local(assignee="none"), [1])
+            self.assertEqual(local(assignee="octocat", milestone="1"), [2])
+            self.assertEqual(local(creator="octocat", state="closed"), [])
+            self.assertEqual(local(sort="updated", direction="asc"), [2, 1])
+            self.assertEqual(local(since="2014-03-01T00:00:00Z"), [1])
+            self.assertEqual(local(sort="comments", limit=1), [1])
+            self.assertRaises(ValueError, local, mentioned="octocat")
+
+            issue = next(issues.search(local=True, creator="hubot"))[1]
+            self.assertTrue(isinstance(issue, GhIssue))
+            self.assertEqual(issue["assignee"]["login"], "octocat")
+
+    def test_issue_entity(self):
+        with self.request_override([
+                dict(urlpath="/user",
+                     response_body='{ "login": "octocat" }'),
+                dict(urlpath="/user/issues",
+                     params=dict(filter="all"),
+                     response_body='[ { "number": 1, "title": "Foo", "url":'
+                                   '    "https://api.github.com/repos/'
+                                   'octocat/Hello-World/issues/1" } ]'),
+                # the closed issues are listed separately
+                dict(urlpath="/user/issues",
+                     params=dict(filter="all", state="closed"),
+                     response_body='[]'),
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/1",
+                     response_body='{ "number": 1, "title": "Foo",'
+                                   '  "body": "Text" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues",
+                     params=dict(state="open"),
+                     response_body='[ { "number": 1, "title": "Bar" } ]')]):
+            user_issues = Github()["users"]["octocat"]["issues"]
+            self.assertEqual([no for no, issue in
+                              user_issues.search(filter="all")], [1])
+
+            # the issue listed for the user is the issue of the repository
+            issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+            issue = issues[1]
+            self.assertEqual(issue["title"], "Foo")
+            self.assertEqual(issue["body"], "Text")
+
+            # the list data is merged into the complete issue
+            list(issues.search(state="open"))
+            issue = issues[1]
+            self.assertEqual(issue["title"], "Bar")
+            self.assertEqual(issue["body"], "Text")
+
+    def test_issue_lazy_cache(self):
+        GhIssue.lazy_cache = True
+        try:
+            with self.request_override([
+                    dict(urlpath="/repos/octocat/Hello-World",
+                         response_body='{ "name": "Hello-World" }'),
+                    dict(urlpath="/repos/octocat/Hello-World/issues/1",
+                         response_body='{ "number": 1, "title": "Foo",'
+                                       '  "user": { "login": "octocat" } }')]):
+                issues = Github()["repos"]["octocat"]["Hello-World"]["issues"]
+                issues[1]
+
+            # the fields are decoded from the cache db on access
+            github_base.memory_cache().clear()
+            with self.request_override([]):
+                issue = issues[1]
+                self.assertTrue(isinstance(issue._lazy,
+                                           serialization.LazyMapping))
+                self.assertEqual(issue._lazy._decoded, {})
+                self.assertEqual(issue["user"]["login"], "octocat")
+                self.assertEqual(issue._lazy._decoded.keys(), ["user"])
+
+                self.assertEqual(sorted(issue.keys()),
+                                 ["number", "title", "user"])
+                self.assertEqual(dict(issue.items())["title"], "Foo")
+        finally:
+            GhIssue.lazy_cache = False
+
+    def test_canonical_query(self):
+        # byte strings are utf-8, non-ascii ones give the same key
+        self.assertEqual(
+            github_base.canonical_query(dict(labels="b\xc3\xa4, a",
+                                             assignee=["j\xc3\xb6"])),
+            github_base.canonical_query(dict(assignee=[u"j\xf6"],
+                                             labels=u"a,b\xe4")))
+
     def test_issues_getitem(self):
         with self.request_override([
                 dict(urlpath="/repos/octocat/Hello-World",
@@ -119,8 +332,7 @@ class TestGithubComments(TestCase):
                      response_body='{ "name": "Hello-World" }'),
                 dict(urlpath="/repos/octocat/Hello-World/issues/1",
                      response_body='{ "number": 1, "state": "open"}'),
-                dict(times=2,
-                     urlpath="/repos/octocat/Hello-World/issues/1/comments",
+                dict(urlpath="/repos/octocat/Hello-World/issues/1/comments",
                      response_body='[ { "id": 1, "body": "Foo" },'
                                    '  { "id": 2, "body": "Bar" } ]')]):
             issue = Github()["repos"]["octocat"]["Hello-World"]["issues"][1]
@@ -128,8 +340,7 @@ class TestGithubComments(TestCase):
 
             self.assertTrue(isinstance(comments, GhIssueComments))
 
-            # list(comments) calls on __iter__ and __len__, resulting
-            # in two separate requests
+            # listing the keys caches the data of the comments, too
             self.assertEqual(comments.keys(), [1, 2])
 
             values = list(comments.itervalues())
@@ -143,6 +354,81 @@ class TestGithubComments(TestCase):
             self.assertTrue(isinstance(comment2[1], GhComment))
             self.assertEqual(comment2[1]["body"], "Bar")
 
+    def test_comments_backfill(self):
+        url = "https://api.github.com/repos/octocat/Hello-World/issues/"
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/comments",
+                     response_body='''
+[ { "id": 1, "body": "Foo", "issue_url": "%(url)s1",
+    "updated_at": "2014-01-01T00:00:00Z" },
+  { "id": 2, "body": "Bar", "issue_url": "%(url)s2",
+    "updated_at": "2014-01-02T00:00:00Z" },
+  { "id": 3, "body": "Baz", "issue_url": "%(url)s1",
+    "updated_at": "2014-01-03T00:00:00Z" },
+  { "id": 4, "body": "Qux", "issue_url": "%(url)s3",
+    "updated_at": "2014-01-04T00:00:00Z" } ]
+                     ''' % dict(url=url))]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["comments"].backfill([1, 2]), ["1", "2"])
+
+        # the comments of the issues are cached without a request per issue
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World/issues/1",
+                     response_body='{ "number": 1, "state": "open"}'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/2",
+                     response_body='{ "number": 2, "state": "open"}')]):
+            issues = repo["issues"]
+            self.assertEqual(sorted((key, comment["body"]) for key, comment
+                                    in issues[1]["comments"].iteritems()),
+                             [(1, "Foo"), (3, "Baz")])
+            self.assertEqual(issues[2]["comments"].keys(), [2])
+
+            # which aren't listed again
+            self.assertEqual(repo["comments"].backfill([1, 2]), [])
+
+    def test_comments_add_dependents(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/comments",
+                     response_body='[ { "id": 1, "body": "Foo" } ]'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/1",
+                     response_body='{ "number": 1,'
+                                   '  "updated_at": "2014-01-01T00:00:00Z" }'),
+                dict(urlpath="/repos/octocat/Hello-World/issues/1/comments",
+                     response_body='[ { "id": 1, "body": "Foo" } ]'),
+                dict(method="POST",
+                     urlpath="/repos/octocat/Hello-World/issues/1/comments",
+                     data=dict(body="Bar"),
+                     response_status="201 Created",
+                     response_body='{ "id": 2, "body": "Bar" }')]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["comments"].keys(), [1])
+            comments = repo["issues"][1]["comments"]
+            self.assertEqual(comments.keys(), [1])
+            comments.add(body="Bar")
+
+        # the comments of the repository list the new comment and the
+        # issue, which github updated, is requested again
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World/issues/1",
+                     response_body='{ "number": 1,'
+                                   '  "updated_at": "2014-01-02T00:00:00Z" }')]):
+            self.assertEqual(sorted(repo["comments"].keys()), [1, 2])
+            self.assertEqual(repo["issues"][1]["updated_at"],
+                             "2014-01-02T00:00:00Z")
+
+        # deleting the comment by the repository removes it from the issue
+        with self.request_override([
+                dict(method="DELETE",
+                     urlpath="/repos/octocat/Hello-World/issues/comments/2",
+                     response_status="204 No Content",
+                     response_body='null')]):
+            del repo["comments"][2]
+            self.assertEqual(repo["issues"][1]["comments"].keys(), [1])
+
     def test_comments_getitem(self):
         with self.request_override([
                 dict(urlpath="/repos/octocat/Hello-World",
@@ -13,6 +13,15 @@ class TestGithubPulls(TestCase):
         with self.request_override([
                 dict(urlpath="/repos/octocat/Hello-World",
                      response_body='{ "name": "Hello-World" }'),
+                dict(urlpath="/repos/octocat/Hello-World/pulls",
+                     params=dict(per_page=1),
+                     response_extra_headers=dict(
+                         Link='<https://api.github.com/repositories/1/pulls?per_page=1&page=2>; rel="next", '
+                              '<https://api.github.com/repositories/1/pulls?per_page=1&page=3>; rel="last"'),
+                     response_body='[ { "number": 1, "state": "open"} ]'),
+                dict(urlpath="/repos/octocat/Hello-World/pulls",
+                     params=dict(per_page=1, state="closed"),
+                     response_body='[ { "number": 2, "state": "closed" } ]'),
                 dict(urlpath="/repos/octocat/Hello-World/pulls",
                      response_body='[ { "number": 1, "state": "open"} ]'),
                 dict(urlpath="/repos/octocat/Hello-World/pulls",
@@ -24,8 +33,12 @@ class TestGithubPulls(TestCase):
             self.assertEqual(pulls._user, "octocat")
             self.assertEqual(pulls._repo, "Hello-World")
 
-            self.assertTrue(len(pulls) == 2)
+            # counted from the rel="last" links: 3 open, 1 closed
+            self.assertEqual(len(pulls), 4)
+            self.assertEqual(pulls.count(), 4)
             self.assertEqual(pulls.keys(), [1, 2])
+            # the listed keys are counted locally
+            self.assertEqual(len(pulls), 2)
 
         with self.request_override([
                 dict(urlpath="/repos/octocat/Hello-World/pulls",
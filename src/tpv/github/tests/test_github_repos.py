@@ -1,9 +1,12 @@
 from __future__ import absolute_import
 
 import itertools
+import time
 
 from .base import TestCase
+from .. import github_base, serialization
 from ..github import Github, GhUserRepos, GhRepo
+from ..github_base import GhBase
 
 
 class TestGithubRepos(TestCase):
@@ -145,3 +148,108 @@ class TestGithubRepo(TestCase):
             self.assertRaises(ValueError,
                               lambda: foreign_repo.__setitem__("description",
                                                           "foo"))
+
+
+class TestCacheLeases(TestCase):
+    def test_stale_while_leased(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }')]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+
+        GhBase.sqlite.execute("update entities set complete_expires = ?,"
+                              " partial_expires = ?",
+                              (int(time.time()) - 10,) * 2)
+
+        # another process is refreshing the repository and doesn't
+        # finish in time, so the stale row is served
+        GhBase.sqlite.execute("insert into leases values (?,?,?,?)",
+                              ("GhRepo", repo._cache_parameters(),
+                               "other", time.time() + 30))
+        prev_lease_wait = github_base.lease_wait
+        github_base.lease_wait = lambda: 0.2
+        try:
+            with self.request_override([]):
+                repo = Github()["repos"]["octocat"]["Hello-World"]
+                self.assertEqual(repo["name"], "Hello-World")
+        finally:
+            github_base.lease_wait = prev_lease_wait
+
+    def test_lease(self):
+        repos = Github()["repos"]["octocat"]
+        self.assertTrue(repos.acquire_lease())
+        # the lease is held until it is released
+        self.assertFalse(repos.acquire_lease())
+        repos.release_lease()
+        self.assertTrue(repos.acquire_lease())
+        repos.release_lease()
+
+    def test_lease_refresh(self):
+        repos = Github()["repos"]["octocat"]
+        # the first fetch has no row to refresh and takes no lease
+        self.assertEqual(repos.lease_refresh(), None)
+        repos.serialize()
+        self.assertTrue(repos.lease_refresh())
+        self.assertFalse(repos.lease_refresh())
+        repos.release_lease()
+
+    def test_collect_garbage(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }')]):
+            Github()["repos"]["octocat"]["Hello-World"]
+
+        # the expired row is kept to be served while another process
+        # refreshes it
+        GhBase.sqlite.execute("update entities set complete_expires = ?,"
+                              " partial_expires = ?",
+                              (int(time.time()) - 10,) * 2)
+        self.assertEqual(github_base.cache_usage()["rows"]["entities"], 1)
+        self.assertEqual(github_base.collect_garbage()["entities"], 0)
+
+        GhBase.sqlite.execute("update entities set complete_expires = ?,"
+                              " partial_expires = ?",
+                              (int(time.time())
+                               - github_base.stale_retention() - 10,) * 2)
+        self.assertEqual(github_base.collect_garbage()["entities"], 1)
+        self.assertEqual(github_base.cache_usage()["rows"]["entities"], 0)
+
+    def test_memory_cache(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World" }')]):
+            Github()["repos"]["octocat"]["Hello-World"]
+
+        counters = github_base.memory_cache().stats()
+        hits = counters.get("GhRepo", dict(hits=0))["hits"]
+
+        # the fresh data is taken from memory, without the cache db
+        with self.request_override([]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["name"], "Hello-World")
+        self.assertEqual(github_base.memory_cache().stats()["GhRepo"]["hits"],
+                         hits + 1)
+
+        # which stays the source of truth for the other processes
+        github_base.memory_cache().clear()
+        with self.request_override([]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["name"], "Hello-World")
+
+    def test_memory_cache_version(self):
+        with self.request_override([
+                dict(urlpath="/repos/octocat/Hello-World",
+                     response_body='{ "name": "Hello-World",'
+                                   '  "description": "Old" }')]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["description"], "Old")
+
+        # another process rewrites the data, keeping the expiral time and
+        # the validators of the row
+        GhBase.sqlite.execute(
+            "update entities set data=?, version=version+1",
+            (buffer(serialization.encode(dict(name="Hello-World",
+                                              description="New"))),))
+        with self.request_override([]):
+            repo = Github()["repos"]["octocat"]["Hello-World"]
+            self.assertEqual(repo["description"], "New")
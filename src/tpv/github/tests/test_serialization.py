@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import pickle
+import unittest
+
+from .. import serialization
+
+
+class TestSerialization(unittest.TestCase):
+    issue = {u"number": 1, u"title": u"Gr\xfc\xdfe", u"labels": [],
+             u"body": u"A long description " * 20, u"assignee": None}
+
+    def test_roundtrip(self):
+        for compress in (False, True):
+            blob = serialization.encode(self.issue, compress)
+            self.assertEqual(serialization.decode(buffer(blob)), self.issue)
+
+        # the pairs of a collection row
+        blob = serialization.encode([(1, "partial"), (2, None)])
+        self.assertEqual(serialization.decode(blob), [[1, "partial"],
+                                                      [2, None]])
+
+    def test_compression(self):
+        plain = serialization.encode(self.issue)
+        packed = serialization.encode(self.issue, compress=True)
+        self.assertTrue(len(packed) < len(plain))
+        self.assertTrue(ord(packed[1]) & serialization.COMPRESSED)
+
+        # compression is skipped, if it doesn't pay off
+        self.assertEqual(serialization.encode(1, compress=True),
+                         serialization.encode(1))
+
+    def test_migrate(self):
+        legacy = pickle.dumps(self.issue)
+        self.assertRaises(ValueError, serialization.decode, legacy)
+
+        blob = serialization.migrate(buffer(legacy))
+        self.assertEqual(serialization.decode(blob), self.issue)
+        self.assertEqual(serialization.migrate(blob), None)
+
+    def test_lazy(self):
+        for compress in (False, True):
+            data = serialization.decode(
+                serialization.encode(self.issue, compress, lazy=True))
+            self.assertTrue(isinstance(data, serialization.LazyMapping))
+            self.assertEqual(sorted(data), sorted(self.issue))
+            self.assertEqual(data._decoded, {})
+
+            # fields are decoded on their first access
+            self.assertEqual(data["title"], self.issue["title"])
+            self.assertEqual(data._decoded.keys(), ["title"])
+            self.assertEqual(data.get("milestone", 0), 0)
+            self.assertRaises(KeyError, lambda: data["milestone"])
+            self.assertEqual(dict(data), self.issue)
+
+        # only objects are split into fields
+        self.assertEqual(serialization.decode(
+            serialization.encode([1, 2], lazy=True)), [1, 2])
@@ -0,0 +1,333 @@
+from __future__ import absolute_import
+
+import sqlite3
+import threading
+import time
+import unittest
+
+from requests.exceptions import ConnectionError
+
+from ..transport import GithubTransport, RateLimiter, RateLimitExceeded, \
+    RetryPolicy, SingleFlight, TokenPool
+from .server import LocalGithub
+
+
+class TestTransport(unittest.TestCase):
+    def test_connection_reuse(self):
+        with LocalGithub({("GET", "/user"):
+                          (200, {}, '{ "login": "octocat" }')}) as server:
+            transport = GithubTransport()
+            for i in range(3):
+                req = transport.request("GET", server.url + "/user")
+                self.assertEqual(req.json()["login"], "octocat")
+
+            self.assertEqual(transport.stats(),
+                             dict(requests=3, connections=1, reused=2,
+                                  retries=0, retry_wait=0, hedged=0))
+            transport.close()
+
+    def test_from_config(self):
+        transport = GithubTransport.from_config({
+            "Transport.pool_maxsize": "3",
+            "Transport.read_timeout": "2.5"})
+        self.assertEqual(transport.pool_maxsize, 3)
+        self.assertEqual(transport.pool_connections,
+                         GithubTransport.pool_connections)
+        self.assertEqual(transport.timeout,
+                         (GithubTransport.connect_timeout, 2.5))
+
+        transport = GithubTransport.from_config({
+            "Retry.retries": "5",
+            "Retry.methods": "get, head"})
+        self.assertEqual(transport.retry.retries, 5)
+        self.assertEqual(transport.retry.methods, ("GET", "HEAD"))
+
+
+def flaky(*responses):
+    """Route answering with `responses` one after the other """
+    responses = list(responses)
+
+    def route(handler):
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+    return route
+
+
+class TestRetry(unittest.TestCase):
+    def setUp(self):
+        self.slept = []
+        self.transport = GithubTransport(
+            retry=RetryPolicy(sleep=self.slept.append, random=lambda: 1.0))
+
+    def tearDown(self):
+        self.transport.close()
+
+    def test_backoff(self):
+        error = (502, {}, '{ "message": "Bad Gateway" }')
+        with LocalGithub({("GET", "/user"):
+                          flaky(error, error,
+                                (200, {}, '{ "login": "octocat" }'))}) \
+                as server:
+            retried = []
+            self.transport.on_retry = \
+                lambda *args: retried.append(args[2:])
+            req = self.transport.request("GET", server.url + "/user")
+            self.assertEqual(req.json()["login"], "octocat")
+
+        self.assertEqual(self.slept, [0.5, 1.0])
+        self.assertEqual(self.transport.stats()["retries"], 2)
+        # each retry is reported before waiting for it
+        self.assertEqual(retried, [(0.5, 502), (1.0, 502)])
+
+    def test_give_up(self):
+        with LocalGithub({("GET", "/user"):
+                          (503, {}, '{ "message": "Unavailable" }')}) \
+                as server:
+            req = self.transport.request("GET", server.url + "/user")
+            self.assertEqual(req.status_code, 503)
+            self.assertEqual(len(server.received), 4)
+
+    def test_retry_after(self):
+        limited = (403, {"Retry-After": "3"},
+                   '{ "message": "You have exceeded a secondary rate limit" }')
+        with LocalGithub({("GET", "/user"):
+                          flaky(limited, (200, {}, '{ "login": "octocat" }'))}) \
+                as server:
+            req = self.transport.request("GET", server.url + "/user")
+            self.assertEqual(req.status_code, 200)
+        self.assertEqual(self.slept, [3])
+
+        # a Retry-After beyond max_backoff is honored as well
+        self.slept[:] = []
+        with LocalGithub({("GET", "/user"):
+                          flaky((403, {"Retry-After": "60"}, limited[2]),
+                                (200, {}, '{ "login": "octocat" }'))}) \
+                as server:
+            req = self.transport.request("GET", server.url + "/user")
+            self.assertEqual(req.status_code, 200)
+        self.assertEqual(self.slept, [60])
+        self.assertEqual(self.transport.stats()["retries"], 2)
+        self.assertEqual(self.transport.stats()["retry_wait"], 63)
+
+        # waiting longer than max_retry_after gives up
+        self.slept[:] = []
+        with LocalGithub({("GET", "/user"):
+                          (403, {"Retry-After": "3600"}, limited[2])}) \
+                as server:
+            req = self.transport.request("GET", server.url + "/user")
+            self.assertEqual(req.status_code, 403)
+        self.assertEqual(self.slept, [])
+
+    def test_not_idempotent(self):
+        with LocalGithub({("POST", "/user/repos"):
+                          (502, {}, '{ "message": "Bad Gateway" }')}) \
+                as server:
+            req = self.transport.request("POST", server.url + "/user/repos",
+                                         data="{}")
+            self.assertEqual(req.status_code, 502)
+            self.assertEqual(len(server.received), 1)
+
+    def test_connection_error(self):
+        server = LocalGithub({})
+        url = server.url
+        server.server_close()
+
+        self.assertRaises(ConnectionError,
+                          self.transport.request, "GET", url + "/user")
+        self.assertEqual(self.slept, [0.5, 1.0, 2.0])
+
+    def test_hedge(self):
+        def slow_once():
+            calls = []
+
+            def route(handler):
+                calls.append(1)
+                if len(calls) == 1:
+                    time.sleep(1)
+                return (200, {}, '{ "login": "octocat" }')
+            return route
+
+        transport = GithubTransport(hedge_percentile=90)
+        transport.hedge_samples = 1
+        transport.latencies.append(0.1)
+        with LocalGithub({("GET", "/user"): slow_once()}) as server:
+            start = time.time()
+            req = transport.request("GET", server.url + "/user")
+            self.assertEqual(req.json()["login"], "octocat")
+            self.assertTrue(time.time() - start < 1)
+
+        self.assertEqual(transport.stats()["hedged"], 1)
+        self.assertEqual(transport.stats()["requests"], 2)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.db = sqlite3.connect(":memory:", isolation_level=None)
+        RateLimiter.create_table(self.db)
+
+        self.now = 1000.0
+        self.slept = []
+
+        def sleep(seconds):
+            self.slept.append(seconds)
+            self.now += seconds
+
+        self.limiter = RateLimiter(lambda: self.db, reserve=10,
+                                   pace_below=100, max_pause=600,
+                                   sleep=sleep, clock=lambda: self.now)
+
+    def record(self, remaining, reset, identity="octocat"):
+        self.limiter.record(identity, {"X-RateLimit-Remaining": remaining,
+                                       "X-RateLimit-Limit": "5000",
+                                       "X-RateLimit-Reset": reset})
+
+    def test_unknown_budget(self):
+        self.assertEqual(self.limiter.budget("octocat"), None)
+        self.assertEqual(self.limiter.acquire("octocat"), 0)
+
+    def test_budget(self):
+        self.record("4000", "1500")
+        self.assertEqual(self.limiter.budget("octocat"),
+                         dict(remaining=4000, limit=5000, reset=1500))
+
+        # an older response of a concurrent request doesn't raise the
+        # remaining budget again
+        self.record("4010", "1500")
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 4000)
+
+        # acquiring consumes the budget before github reports it
+        self.assertEqual(self.limiter.acquire("octocat"), 0)
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3999)
+
+        # after the reset the full budget is available
+        self.now = 1500
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 5000)
+
+    def test_persist_every(self):
+        self.record("4000", "1500")
+        changes = self.db.total_changes
+        for i in range(19):
+            self.limiter.acquire("octocat")
+        # the budget was only read, this process counts what it consumed
+        self.assertEqual(self.db.total_changes, changes)
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3981)
+
+        self.limiter.acquire("octocat")
+        self.assertEqual(self.db.execute("select remaining from ratelimit")
+                         .fetchone()[0], 3980)
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3980)
+
+        # a response reporting about the same budget isn't written
+        changes = self.db.total_changes
+        self.record("3975", "1500")
+        self.assertEqual(self.db.total_changes, changes)
+        self.record("3900", "1500")
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3900)
+
+        # a recorded budget covers the requests consumed before
+        for i in range(5):
+            self.limiter.acquire("octocat")
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3895)
+        self.record("3850", "1500")
+        self.assertEqual(self.limiter.budget("octocat")["remaining"], 3850)
+
+    def test_pacing(self):
+        # 90 requests left, 80 above the reserve, in 400 seconds
+        self.record("90", "1400")
+        self.assertEqual(self.limiter.acquire("octocat"), 0)
+        self.assertEqual(self.limiter.acquire("octocat"), 5)
+        self.assertEqual(self.slept, [5])
+
+    def test_pause(self):
+        self.record("10", "1100")
+        self.limiter.acquire("octocat")
+        self.assertEqual(self.slept, [101])
+
+        self.record("10", "2000")
+        self.assertRaises(RateLimitExceeded, self.limiter.acquire, "octocat")
+
+
+class TestTokenPool(unittest.TestCase):
+    def setUp(self):
+        self.budgets = dict()
+        self.pool = TokenPool.from_config(
+            {"github.user": "octocat", "github.token": "secret",
+             "github tokens": {"hubot": "robot", "octocat": "secret"}},
+            lambda identity: self.budgets.get(identity))
+
+    def test_configured(self):
+        self.assertEqual(self.pool.tokens,
+                         [("octocat", "secret"), ("hubot", "robot")])
+        self.assertEqual(TokenPool.configured({"github.user": "octocat",
+                                               "github.token": "secret"}),
+                         [("octocat", "secret")])
+
+    def test_choose(self):
+        # unknown budgets are tried first
+        self.budgets["octocat"] = dict(remaining=4000)
+        self.assertEqual(self.pool.choose("GET", "/repos/octocat/Hello"),
+                         ("hubot", "robot"))
+
+        self.budgets["hubot"] = dict(remaining=3000)
+        self.assertEqual(self.pool.choose("GET", "/repos/octocat/Hello"),
+                         ("octocat", "secret"))
+
+        # mutations and the authenticated user stay with the primary
+        self.budgets["hubot"] = dict(remaining=5000)
+        self.assertEqual(self.pool.choose("PATCH", "/repos/octocat/Hello"),
+                         ("octocat", "secret"))
+        self.assertEqual(self.pool.choose("GET", "/user/repos"),
+                         ("octocat", "secret"))
+        self.assertEqual(self.pool.choose("GET", "/users/hubot"),
+                         ("hubot", "robot"))
+
+        self.assertEqual(self.pool.stats(),
+                         dict(octocat=dict(requests=3, remaining=4000),
+                              hubot=dict(requests=2, remaining=5000)))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def run_concurrently(self, func, n=5):
+        results = []
+
+        def call():
+            try:
+                results.append(func())
+            except Exception as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=call) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalescing(self):
+        flight = SingleFlight()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return "response"
+
+        results = self.run_concurrently(
+            lambda: flight.do(("GET", "/user"), fetch))
+        self.assertEqual(results, ["response"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), dict(saved=4))
+
+        # finished calls aren't shared
+        self.assertEqual(flight.do(("GET", "/user"), fetch), "response")
+        self.assertEqual(len(calls), 2)
+
+    def test_exception(self):
+        flight = SingleFlight()
+
+        def fetch():
+            time.sleep(0.2)
+            raise ValueError("Not Found")
+
+        results = self.run_concurrently(
+            lambda: flight.do(("GET", "/user"), fetch))
+        self.assertTrue(all(isinstance(x, ValueError) for x in results))
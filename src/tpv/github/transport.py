@@ -0,0 +1,681 @@
+"""HTTP transport used for all requests to github
+
+The transport keeps a `requests.Session` with one pool of keep-alive
+connections per host, so that consecutive requests (f.ex. the pages of
+a paginated list) reuse the same TCP/TLS connection instead of paying
+a new handshake each time.
+
+It is configured from the "Transport" section of the config:
+
+  [Transport]
+  pool_connections=<number of hosts to keep a pool for>
+  pool_maxsize=<number of connections kept per host>
+  connect_timeout=<seconds>
+  read_timeout=<seconds>
+  hedge_percentile=<latency percentile after which a GET is sent again>
+
+Failed requests are retried as configured in the "Retry" section (see
+RetryPolicy):
+
+  [Retry]
+  retries=<number of retries of a request>
+  backoff=<seconds of the first backoff, doubled for each retry>
+  max_backoff=<seconds to back off at most before a retry>
+  max_retry_after=<seconds of a Retry-After header, beyond which to give up>
+  methods=<comma separated methods, which are retried>
+
+The RateLimiter schedules requests by the budget github reports in the
+X-RateLimit-* response headers; it is configured from the "Rate limit"
+section:
+
+  [Rate limit]
+  reserve=<remaining requests at which to wait for the reset>
+  pace_below=<remaining requests below which requests are spread out>
+  max_pause=<seconds to wait at most, before raising RateLimitExceeded>
+  persist_every=<requests consumed before the budget is written back>
+
+The TokenPool spreads read-only requests across the tokens of several
+identities, which are listed besides the primary one from the "github"
+section in the "github tokens" section:
+
+  [github tokens]
+  <user>=<personal access token>
+"""
+
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_tz, mktime_tz
+from Queue import Queue, Empty
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+
+def config_option(config, key, default, argtype=int):
+    """Return option `key` ("section.option") from `config` or `default` """
+    try:
+        return argtype(config[key])
+    except KeyError:
+        return default
+
+
+class RetryPolicy(object):
+    """Decides whether and when a failed request is sent again
+
+Connection errors, timeouts, 5xx responses and the 403/429 responses of
+github's secondary rate limits are retried, if the method is among
+`methods` (idempotent ones by default). The backoff doubles with each
+retry starting from `backoff` and is jittered over the interval up to
+it, up to `max_backoff`. A Retry-After header is honored instead, also
+beyond `max_backoff`; one longer than `max_retry_after` gives up.
+    """
+
+    retries = 3
+    backoff = 0.5
+    max_backoff = 30
+    max_retry_after = 15*60
+    methods = ("GET", "HEAD", "PUT", "DELETE")
+    statuses = (500, 502, 503, 504)
+
+    def __init__(self, retries=None, backoff=None, max_backoff=None,
+                 max_retry_after=None, methods=None, sleep=time.sleep,
+                 random=random.random):
+        if retries is not None:
+            self.retries = retries
+        if backoff is not None:
+            self.backoff = backoff
+        if max_backoff is not None:
+            self.max_backoff = max_backoff
+        if max_retry_after is not None:
+            self.max_retry_after = max_retry_after
+        if methods is not None:
+            self.methods = methods
+        self.sleep = sleep
+        self.random = random
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a retry policy with the options of the "Retry" section """
+        methods = config_option(config, "Retry.methods", None, str)
+        return cls(
+            retries=config_option(config, "Retry.retries", None),
+            backoff=config_option(config, "Retry.backoff", None, float),
+            max_backoff=config_option(config, "Retry.max_backoff",
+                                      None, float),
+            max_retry_after=config_option(config, "Retry.max_retry_after",
+                                          None, float),
+            methods=None
+            if methods is None
+            else tuple(x.strip().upper() for x in methods.split(",")))
+
+    def retryable(self, method, attempt):
+        """Whether a request may be sent again after `attempt` retries """
+        return method in self.methods and attempt < self.retries
+
+    def transient(self, response):
+        """Whether `response` reports a failure worth a retry """
+        if response.status_code in self.statuses:
+            return True
+        if response.status_code in (403, 429):
+            return "Retry-After" in response.headers \
+                or "secondary rate limit" in response.text.lower()
+        return False
+
+    def delay(self, attempt, response=None):
+        """Return the seconds to wait before retry `attempt` (counting from
+0) or None to give up.
+        """
+        if response is not None and "Retry-After" in response.headers:
+            wait = retry_after(response.headers["Retry-After"])
+            if wait is not None:
+                return wait if wait <= self.max_retry_after else None
+
+        return self.random() * min(self.backoff * 2 ** attempt,
+                                   self.max_backoff)
+
+
+def retry_after(value):
+    """Return the seconds of a Retry-After header (seconds or date) """
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(mktime_tz(date) - time.time(), 0)
+
+
+class GithubTransport(object):
+    """Keep-alive HTTP session with a connection pool per host
+
+Counts the requests it sends and, from the connection pools, how many
+connections had to be opened, so reuse can be confirmed with stats().
+
+Failed requests are retried by the `retry` policy; `on_retry` is
+called with (method, url, seconds to wait, reason) before each retry,
+f.ex. to report it. With a
+`hedge_percentile`, a GET which takes longer than that percentile of
+the latencies of recent GETs is sent a second time and the first
+response wins.
+    """
+
+    pool_connections = 4
+    pool_maxsize = 10
+    connect_timeout = 10
+    read_timeout = 60
+    hedge_percentile = 0
+    # GET latencies needed before requests are hedged
+    hedge_samples = 20
+
+    def __init__(self, pool_connections=None, pool_maxsize=None,
+                 connect_timeout=None, read_timeout=None, retry=None,
+                 hedge_percentile=None, on_retry=None):
+        if pool_connections is not None:
+            self.pool_connections = pool_connections
+        if pool_maxsize is not None:
+            self.pool_maxsize = pool_maxsize
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if hedge_percentile is not None:
+            self.hedge_percentile = hedge_percentile
+        self.retry = RetryPolicy() if retry is None else retry
+        self.on_retry = on_retry
+
+        self.adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                   pool_maxsize=self.pool_maxsize,
+                                   max_retries=0)
+        self.session = Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.retry_wait = 0
+        self.hedged = 0
+        self.latencies = deque(maxlen=200)
+
+    @classmethod
+    def from_config(cls, config, on_retry=None):
+        """Create a transport with the options of the "Transport" section
+and the retry policy of the "Retry" section.
+        """
+        return cls(
+            pool_connections=config_option(config,
+                                           "Transport.pool_connections",
+                                           None),
+            pool_maxsize=config_option(config, "Transport.pool_maxsize", None),
+            connect_timeout=config_option(config,
+                                          "Transport.connect_timeout",
+                                          None, float),
+            read_timeout=config_option(config, "Transport.read_timeout",
+                                       None, float),
+            retry=RetryPolicy.from_config(config),
+            hedge_percentile=config_option(config,
+                                           "Transport.hedge_percentile",
+                                           None, float),
+            on_retry=on_retry
+        )
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pooled session
+
+Takes the same arguments as `requests.Session.request`; the timeout
+defaults to the configured (connect, read) timeouts. Returns the last
+response, once it succeeded or the retry policy gave up; raises the
+connection error of the last attempt.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, url, kwargs)
+            except (ConnectionError, Timeout) as exc:
+                if not self.retry.retryable(method, attempt):
+                    raise
+                delay = self.retry.delay(attempt)
+                reason = exc.__class__.__name__
+            else:
+                if not (self.retry.retryable(method, attempt)
+                        and self.retry.transient(response)):
+                    return response
+                delay = self.retry.delay(attempt, response)
+                if delay is None:
+                    return response
+                reason = response.status_code
+
+            with self._lock:
+                self.retries += 1
+                self.retry_wait += delay
+            if self.on_retry is not None:
+                self.on_retry(method, url, delay, reason)
+            self.retry.sleep(delay)
+            attempt += 1
+
+    def _send(self, method, url, kwargs):
+        """Send one attempt of a request, hedged if it is a slow GET """
+        if method != "GET":
+            return self._send_once(method, url, kwargs)
+
+        start = time.time()
+        delay = self.hedge_delay()
+        if delay is None:
+            response = self._send_once(method, url, kwargs)
+        else:
+            response = self._send_hedged(method, url, kwargs, delay)
+        with self._lock:
+            self.latencies.append(time.time() - start)
+        return response
+
+    def _send_once(self, method, url, kwargs):
+        with self._lock:
+            self.requests += 1
+        return self.session.request(method, url, **kwargs)
+
+    def _send_hedged(self, method, url, kwargs, delay):
+        """Send the request and, if it didn't finish after `delay` seconds,
+a second one; the first response is returned.
+        """
+        results = Queue()
+
+        def send():
+            try:
+                results.put((self._send_once(method, url, kwargs),))
+            except Exception:
+                results.put(sys.exc_info())
+
+        def start():
+            thread = threading.Thread(target=send)
+            thread.daemon = True
+            thread.start()
+
+        start()
+        try:
+            result = results.get(True, delay)
+            pending = 0
+        except Empty:
+            with self._lock:
+                self.hedged += 1
+            start()
+            result = results.get()
+            pending = 1
+
+        if len(result) == 3 and pending:
+            # the other request may still succeed
+            result = results.get()
+        if len(result) == 3:
+            raise result[0], result[1], result[2]
+        return result[0]
+
+    def hedge_delay(self):
+        """Return the `hedge_percentile` of the recent GET latencies or
+None, if GETs aren't hedged (yet).
+        """
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self.latencies) < self.hedge_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = int(len(latencies) * self.hedge_percentile / 100.)
+        return latencies[min(index, len(latencies) - 1)]
+
+    def stats(self):
+        """Return a dictionary of connection usage counters
+
+`requests`    -- requests sent through the transport, with retries
+`connections` -- connections opened by the pools of the live hosts
+`reused`      -- requests which were sent on an already open connection
+`retries`     -- failed requests which were sent again
+`retry_wait`  -- seconds waited before the retries
+`hedged`      -- slow GETs which were sent a second time
+        """
+        pools = self.adapter.poolmanager.pools
+        connections = 0
+        pool_requests = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pool_requests += pool.num_requests
+
+        return dict(requests=self.requests,
+                    connections=connections,
+                    reused=max(pool_requests - connections, 0),
+                    retries=self.retries,
+                    retry_wait=self.retry_wait,
+                    hedged=self.hedged)
+
+    def close(self):
+        self.session.close()
+
+
+class SingleFlight(object):
+    """Coalesces identical concurrent calls into one
+
+do(key, func) calls func(), unless a call with the same key is already
+in flight. Then it waits for that call and returns its result (or
+raises its exception). `saved` counts the calls which were spared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self.saved = 0
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = dict(done=threading.Event())
+            else:
+                self.saved += 1
+
+        if not leader:
+            call["done"].wait()
+            if "exc_info" in call:
+                (exc_type, exc_value, exc_tb) = call["exc_info"]
+                raise exc_type, exc_value, exc_tb
+            return call["result"]
+
+        try:
+            call["result"] = func()
+            return call["result"]
+        except:
+            call["exc_info"] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def stats(self):
+        return dict(saved=self.saved)
+
+
+class RateLimitExceeded(RuntimeError):
+    """Raised instead of waiting longer than max_pause for a reset """
+
+
+class RateLimiter(object):
+    """Schedules requests by the rate limit budget github reports
+
+The budget of each identity (user name) is taken from the
+X-RateLimit-* headers of the responses and kept in table `ratelimit`
+of the cache db, so all processes sharing the cache db see and
+consume the same budget. Before a request is sent
+
+- with less than `pace_below` remaining requests, the requests of all
+  processes are spread evenly over the time until the reset,
+- with `reserve` remaining requests, they wait for the reset.
+
+Above `pace_below` the budget is only read, which doesn't take the
+write lock of the cache db, and the requests consumed by this process
+are written back every `persist_every` requests; responses correct the
+budget anyway. Pacing reads and consumes it in one transaction.
+
+`connection` is a callable returning a sqlite connection to the cache
+db for the calling thread.
+    """
+
+    reserve = 10
+    pace_below = 500
+    max_pause = 15*60
+    persist_every = 20
+
+    def __init__(self, connection, reserve=None, pace_below=None,
+                 max_pause=None, persist_every=None, sleep=time.sleep,
+                 clock=time.time):
+        self.connection = connection
+        if reserve is not None:
+            self.reserve = reserve
+        if pace_below is not None:
+            self.pace_below = pace_below
+        if max_pause is not None:
+            self.max_pause = max_pause
+        if persist_every is not None:
+            self.persist_every = persist_every
+        self.sleep = sleep
+        self.clock = clock
+        # (reset, count) of the requests consumed by this process, which
+        # weren't written back, by identity
+        self.pending = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, connection, config):
+        """Create a rate limiter with the options of the "Rate limit"
+section
+        """
+        return cls(connection,
+                   reserve=config_option(config, "Rate limit.reserve", None),
+                   pace_below=config_option(config, "Rate limit.pace_below",
+                                            None),
+                   max_pause=config_option(config, "Rate limit.max_pause",
+                                           None, float),
+                   persist_every=config_option(config,
+                                               "Rate limit.persist_every",
+                                               None))
+
+    @staticmethod
+    def create_table(db):
+        # `slot` is the earliest time for the next paced request
+        db.execute("create table if not exists ratelimit"
+                   "(identity text primary key, remaining integer,"
+                   " quota integer, reset integer, slot real)")
+
+    def budget(self, identity):
+        """Return the budget of `identity` as dictionary with the keys
+remaining, limit and reset (unix time) or None, if it is unknown.
+        """
+        row = self.connection().execute(
+            "select remaining, quota, reset from ratelimit"
+            " where identity=?", (identity,)).fetchone()
+        if row is None:
+            return None
+
+        (remaining, quota, reset) = row
+        if reset <= self.clock():
+            # the budget has been reset since
+            remaining = quota
+        else:
+            remaining = max(remaining - self._pending(identity, reset), 0)
+        return dict(remaining=remaining, limit=quota, reset=reset)
+
+    def record(self, identity, headers):
+        """Update the budget of `identity` from response `headers` """
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            quota = int(headers["X-RateLimit-Limit"])
+            reset = int(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        db = self.connection()
+        row = db.execute("select remaining, reset from ratelimit"
+                         " where identity=?", (identity,)).fetchone()
+        if row is not None and row[1] >= reset:
+            drift = row[0] - remaining
+            # only a noticeably lower count of the current window is
+            # written, the others would leave the budget as it is
+            if row[1] > reset or drift <= 0 \
+                    or (drift < self.persist_every
+                        and remaining > self.pace_below):
+                return
+
+        db.execute("insert or ignore into ratelimit"
+                   " values (?,?,?,?,0)", (identity, remaining, quota, reset))
+        # responses of concurrent requests arrive in any order, within
+        # the same window the lowest remaining count is the current one
+        db.execute("update ratelimit set remaining=?, quota=?, reset=?"
+                   " where identity=? and (reset < ? or remaining > ?)",
+                   (remaining, quota, reset, identity, reset, remaining))
+        # the reported budget covers the requests this process consumed
+        # so far, they aren't subtracted again
+        with self._lock:
+            self.pending.pop(identity, None)
+
+    def acquire(self, identity):
+        """Wait until the budget of `identity` allows another request and
+account for it.
+
+Returns the number of seconds waited.
+        """
+        db = self.connection()
+        # far above pace_below the budget is only read, which doesn't take
+        # the write lock of the cache db
+        row = db.execute("select remaining, quota, reset from ratelimit"
+                         " where identity=?", (identity,)).fetchone()
+        if row is None:
+            return 0
+
+        (remaining, quota, reset) = row
+        if reset <= self.clock():
+            (remaining, reset) = (quota, None)
+        with self._lock:
+            consumed = self._pending(identity, reset) + 1
+            if remaining - consumed > self.pace_below \
+                    and consumed < self.persist_every:
+                self.pending[identity] = (reset, consumed)
+                return 0
+            self.pending.pop(identity, None)
+
+        # the budget is read and consumed in one transaction, so that
+        # concurrent processes don't take the same slot
+        db.execute("begin immediate")
+        try:
+            (wait, reset) = self._schedule(db, identity, consumed)
+        finally:
+            db.execute("commit")
+
+        if wait > self.max_pause:
+            raise RateLimitExceeded("Rate limit of {} exhausted until {}"
+                                    .format(identity, time.ctime(reset)))
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def _pending(self, identity, reset):
+        """Return the requests of `identity` consumed until `reset`, which
+weren't written back.
+        """
+        (until, count) = self.pending.get(identity, (None, 0))
+        return count if until == reset else 0
+
+    def _schedule(self, db, identity, consumed=1):
+        """Return (seconds to wait, reset time) for the next request of
+`identity` and consume `consumed` requests of its budget (the next one
+and those not written back yet).
+        """
+        row = db.execute("select remaining, quota, reset, slot"
+                         " from ratelimit where identity=?",
+                         (identity,)).fetchone()
+        if row is None:
+            return (0, None)
+
+        (remaining, quota, reset, slot) = row
+        now = self.clock()
+        start = now
+        if reset <= now:
+            remaining = quota
+        elif remaining <= self.reserve:
+            start = reset + 1
+        elif remaining <= self.pace_below:
+            interval = float(reset - now) / (remaining - self.reserve)
+            start = max(now, slot)
+            slot = start + interval
+
+        if start - now <= self.max_pause:
+            db.execute("update ratelimit set remaining=?, slot=?"
+                       " where identity=?",
+                       (max(remaining - consumed, 0), slot, identity))
+        return (start - now, reset)
+
+
+class TokenPool(object):
+    """Chooses the identity (user name and token) a request is sent with
+
+Read-only requests go to the identity with the most remaining budget,
+as reported by `budget` (a callable like RateLimiter.budget; unknown
+budgets are tried first). Mutating requests and requests about the
+authenticated user itself are pinned to the `primary` identity.
+
+`tokens` is a list of (identity, token) tuples, the primary first. All
+tokens should have access to the same repositories, as the cache is
+shared between them.
+    """
+
+    read_methods = ("GET", "HEAD")
+    # answered for the identity sending the request
+    pinned_path = re.compile(r"/(user|rate_limit)(/|\?|$)")
+
+    def __init__(self, tokens, budget):
+        self.tokens = tokens
+        self.primary = tokens[0][0]
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self.requests = dict((identity, 0) for identity, token in tokens)
+
+    @staticmethod
+    def configured(config):
+        """Return the (identity, token) tuples of `config`, the one of the
+"github" section first.
+        """
+        tokens = [(config["github.user"], config["github.token"])]
+        try:
+            section = config["github tokens"]
+        except KeyError:
+            section = dict()
+        for identity, token in sorted(section.iteritems()):
+            if identity != tokens[0][0]:
+                tokens.append((identity, token))
+        return tokens
+
+    @classmethod
+    def from_config(cls, config, budget):
+        return cls(cls.configured(config), budget)
+
+    def choose(self, method, urlpath):
+        """Return (identity, token) for a request and count it """
+        if len(self.tokens) == 1 or method not in self.read_methods \
+           or self.pinned_path.match(urlpath):
+            (identity, token) = self.tokens[0]
+        else:
+            # max keeps the first of equal budgets, the primary
+            (identity, token) = max(self.tokens,
+                                    key=lambda x: self._remaining(x[0]))
+
+        with self._lock:
+            self.requests[identity] += 1
+        return (identity, token)
+
+    def _remaining(self, identity):
+        budget = self.budget(identity)
+        return float("inf") if budget is None else budget["remaining"]
+
+    def stats(self):
+        """Return {identity: counters} with the requests sent by each
+identity and its remaining budget, if known.
+        """
+        ret = dict()
+        for identity, token in self.tokens:
+            counters = dict(requests=self.requests[identity])
+            budget = self.budget(identity)
+            if budget is not None:
+                counters["remaining"] = budget["remaining"]
+            ret[identity] = counters
+        return ret